@@ -1,8 +1,11 @@
 import math
+from typing import Callable
 import term
 import color
 import bios
+import live
 import ui
+import width
 
 
 copyright_string = "Copyright (C) 2024 Company Inc."
@@ -18,6 +21,9 @@ F10: Save and Exit
 ESC: Exit"""
 help_keys_count = len(help_keys.splitlines())
 
+# Lines scrolled by a mouse wheel step on log pages
+wheel_lines = 3
+
 ColorPair = tuple[int, int]
 
 dialog_palette: color.Palette = {
@@ -49,14 +55,14 @@ def message_box(
     return ui.message_box(title, text, options, selected, palette)
 
 
-def select_item(item: object):
+def select_item(item: bios.Item):
     value = ui.select_box(
         title=item["title"],
         items=item["values"],
-        selected=item["value"],
+        selected=bios.get_value(item),
         palette=dialog_palette,
     )
-    item["value"] = value
+    bios.set_value(item, value)
 
 
 def draw_tabs(
@@ -73,7 +79,7 @@ def draw_tabs(
             term.set_color(palette["selected"])
 
         if selected_only and i != selected:
-            term.rawprint(" " * (len(tabs[i]) + 2))
+            term.rawprint(" " * (width.width(tabs[i]) + 2))
         else:
             term.rawprint(f" {tabs[i]} ")
 
@@ -81,6 +87,18 @@ def draw_tabs(
             term.set_color(palette["disabled"])
 
 
+def set_tab_hits(tabs: list[str], is_subpage: bool = False):
+    # Tabs of a subpage are hidden, they can't be clicked
+    hits = []
+    x = 4
+    for i in range(len(tabs)):
+        tab_width = width.width(tabs[i]) + 2
+        if not is_subpage:
+            hits.append(((x, 2, tab_width, 1), ("tab", i)))
+        x += tab_width
+    term.set_hits("tabs", hits)
+
+
 def draw_help_area():
     w, h = term.get_size()
 
@@ -101,11 +119,27 @@ def draw_help_text(text: str = ""):
     x = w - help_width + 2
     width = help_width - 2
 
-    term.fill((x, 4, width, h - 8 - help_keys_count))
-    term.draw_text(text, (x, 4, width, 0))
+    height = h - 8 - help_keys_count
+    term.fill((x, 4, width, height))
+    term.draw_text(text, (x, 4, width, max(1, height)))
+
+
+chrome_cache = term.BlobCache(16)
 
 
 def draw_screen(tabs: list[str], page_index: str, is_subpage: bool = False):
+    key = (
+        term.get_size(),
+        tuple(tabs),
+        page_index,
+        is_subpage,
+        color.get_palette_key(header_palette),
+        color.get_palette_key(screen_palette),
+    )
+    chrome_cache.draw(key, lambda: render_screen(tabs, page_index, is_subpage))
+
+
+def render_screen(tabs: list[str], page_index: str, is_subpage: bool = False):
     w, h = term.get_size()
 
     # Draw title texts
@@ -131,14 +165,176 @@ def draw_screen(tabs: list[str], page_index: str, is_subpage: bool = False):
     draw_help_area()
 
 
-def bios_page(page_gen: bios.PageGenerator) -> int:
+Idle = Callable[[], float | None]
+
+
+def read_key_idle(timeout: float | None, idle: Idle) -> str | None:
+    # Let idle work run in small steps while no key is waiting, it returns
+    # 0 to be called again, seconds until it wants to be called or None
+    term.flush()
+    wait = idle()
+    while wait == 0:
+        key = term.read_key(0)
+        if key is not None:
+            return key
+        wait = idle()
+
+    if wait is not None and (timeout is None or wait < timeout):
+        timeout = wait
+    return term.read_key(timeout)
+
+
+def read_page_key(
+    items: list[bios.Item],
+    selected: int,
+    item_range: bios.Range,
+    rect: term.Rectangle,
+    idle: Idle = lambda: None,
+) -> str:
+    w, h = term.get_size()
+    start_index, end_index = item_range
+
+    while True:
+        visible = items[start_index:end_index]
+
+        term.set_pos((w, h))
+        key = read_key_idle(live.get_timeout(visible), idle)
+
+        # Skip mouse events that wouldn't change anything
+        if key == "MOUSE":
+            mouse = term.get_mouse()
+            target = mouse["target"]
+            if target is None:
+                continue
+            # Hovering only moves the selection between items
+            if mouse["motion"] and (target[0] == "tab" or target[1] == selected):
+                continue
+
+        if key is not None:
+            return key
+
+        # Refresh expired live values and redraw only the changed cells
+        changed = [start_index + i for i in live.refresh(visible)]
+        ui.draw_item_values(items, changed, selected, item_range, rect, screen_palette)
+
+
+def get_log_status(log, start: int, total: int, rows: int) -> str:
+    if log.error:
+        return f"Can't open {log.path}: {log.error}"
+
+    # The total is a lower bound until the whole file is indexed
+    status = f"Line {start + 1} of {total}"
+    if log.indexing:
+        status += "+ (indexing)"
+    return status + "\n\nPgUp/PgDn: Scroll page\nHome/End: First/last line\nG: Go to line"
+
+
+def bios_log_page(page: bios.Page, redraw: Callable[[], None], idle: Idle) -> int:
+    # Pages with a log were made by logview, it's already loaded by now
+    import logview
+
+    w, h = term.get_size()
+    log = page["log"]
+
+    rect = (2, 4, w - help_width - 2, h - 6)
+    rows = rect[3]
+    start = 0
+    follow = False
+    shown = None
+
+    # Log lines can't be clicked, only scrolled
+    term.set_hits("items", [])
+
+    while True:
+        total = log.get_line_count()
+        last = max(0, total - rows)
+
+        # Keep showing the end of logs that are still being written
+        if follow:
+            start = last
+        start = max(0, min(start, last))
+
+        # Only read and draw the visible lines when something changed
+        status = get_log_status(log, start, total, rows)
+        if shown != (start, total, status):
+            ui.draw_lines(log.get_lines(start, rows), start, total, rect, screen_palette)
+            draw_help_text(status)
+            shown = (start, total, status)
+
+        term.set_pos((w, h))
+        key = read_key_idle(logview.poll_interval, idle)
+
+        if key is None:
+            continue
+        elif key == "UP":
+            start -= 1
+        elif key == "DOWN":
+            start += 1
+        elif key == "PGUP":
+            start -= rows
+        elif key == "PGDN":
+            start += rows
+        elif key == "HOME":
+            start = 0
+        elif key == "END":
+            start = last
+        elif key == "WHEELUP":
+            start -= wheel_lines
+        elif key == "WHEELDOWN":
+            start += wheel_lines
+        elif key == "MOUSE":
+            mouse = term.get_mouse()
+            if mouse["target"] and mouse["target"][0] == "tab" and not mouse["motion"]:
+                return mouse["target"][1]
+        elif key in ("g", "G"):
+            line = ui.input_box(
+                "Go to Line",
+                f"Line number (1-{total})",
+                len(str(total)),
+                dialog_palette,
+                "0123456789",
+            )
+            if line:
+                start = int(line) - 1
+            redraw()
+            shown = None
+        elif key == "LEFT":
+            return -2
+        elif key == "RIGHT":
+            return -3
+        elif key == "ESC":
+            return -4
+        else:
+            term.beep()
+
+        follow = key == "END"
+
+
+def bios_page(
+    page_gen: bios.PageGenerator,
+    redraw: Callable[[], None] = lambda: None,
+    idle: Idle = lambda: None,
+    drawn: bool = False,
+    selection_key: bios.PageGenerator | None = None,
+) -> int:
     w, h = term.get_size()
+    # Prerendered pages stand in for their generator, the selection is kept
+    # under the real one
+    selection_key = selection_key or page_gen
 
     page = page_gen()
+    if "log" in page:
+        return bios_log_page(page, redraw, idle)
+
     items = page["items"]
 
+    state = bios.current_state()
+
     item_range = (0, h - 7)
-    item_selected = bios.get_selectable_index(items)
+    item_selected = state.get_selected(
+        selection_key, bios.get_selectable_index(items)
+    )
+    items_rect = (2, 4, w - help_width - 2, h - 6)
 
     while True:
         page = page_gen()
@@ -146,37 +342,76 @@ def bios_page(page_gen: bios.PageGenerator) -> int:
 
         item = items[item_selected]
 
-        # Draw items
-        item_range = ui.draw_items(
-            items,
-            item_selected,
-            item_range,
-            (2, 4, w - help_width - 2, h - 6),
-            screen_palette,
-        )
-
-        # Draw help text for currently selected item
-        draw_help_text(item["help"] if "help" in item else item["title"])
-
-        # Read key
-        term.set_pos((w, h))
-        key = term.read_key()
-
-        if key == "UP":
+        if drawn:
+            # The page was shown from a prerendered frame, only its live
+            # values may be older than the frame
+            drawn = False
+            item_range = bios.get_screen_range(item_selected, item_range)
+            start_index, end_index = item_range
+            changed = [
+                start_index + i
+                for i, visible in enumerate(items[start_index:end_index])
+                if live.is_live(visible)
+            ]
+            ui.draw_item_values(
+                items, changed, item_selected, item_range, items_rect, screen_palette
+            )
+        else:
+            # Draw items
+            item_range = ui.draw_items(
+                items,
+                item_selected,
+                item_range,
+                items_rect,
+                screen_palette,
+            )
+
+            # Draw help text for currently selected item
+            draw_help_text(item["help"] if "help" in item else item["title"])
+
+        ui.set_item_hits(items, item_range, items_rect)
+
+        # Read key, waking up when a visible live value expires
+        key = read_page_key(items, item_selected, item_range, items_rect, idle)
+
+        if key == "MOUSE":
+            mouse = term.get_mouse()
+            kind, index = mouse["target"]
+            if kind == "tab":
+                # Go to the clicked page
+                return index
+            elif index != item_selected:
+                # Select the clicked or hovered item
+                item_selected = index
+                state.set_selected(selection_key, item_selected)
+                continue
+            elif mouse["button"] == 0 and not mouse["motion"]:
+                # Clicking the selected item works like Enter
+                key = "ENTER"
+
+        if key in ("UP", "WHEELUP"):
             # Go to previous item
             item_selected = bios.get_selectable_index(items, item_selected, True)
-        elif key == "DOWN":
+            state.set_selected(selection_key, item_selected)
+        elif key in ("DOWN", "WHEELDOWN"):
             # Go to next item
             item_selected = bios.get_selectable_index(items, item_selected)
+            state.set_selected(selection_key, item_selected)
         elif key == "ENTER":
             # Execute current item's function if available
             if "type" in item:
                 if "function" in item:
                     item["function"](item)
                 elif "subpage" in item:
-                    bios_page(item["subpage"])
+                    # A tab clicked on a subpage goes straight to that page
+                    new_index = bios_page(item["subpage"], redraw)
+                    if new_index >= 0:
+                        return new_index
                 elif item["type"] == "select":
                     select_item(item)
+
+                # Restore the screen chrome covered by dialogs
+                redraw()
         elif key == "LEFT":
             # Go to previous page
             return -2
@@ -186,27 +421,73 @@ def bios_page(page_gen: bios.PageGenerator) -> int:
         elif key == "ESC":
             # Go to last page (Exit page)
             return -4
-        else:
+        elif key not in term.mouse_keys:
             term.beep()
 
 
+# Draw the tabs next to the current one off-screen while no keys are waiting,
+# switching to them then only sends the cells that differ. Only terminals that
+# ask for it do this (the console), sessions served to many clients keep their
+# memory small
+prerender_tabs = True
+
+
 def bios_screen(
     pages_gen: bios.PageGenerators, page_index: int = 0, is_subpage: bool = False
 ):
+    # Only the current page is built, other tabs just need their titles
+    tabs = [bios.get_page_title(page_gen) for page_gen in pages_gen]
+
+    page_total = len(pages_gen)
+
+    terminal = term.current()
+    if not is_subpage:
+        # Probing needs json for its cache, keep it out of the import time
+        import caps
+
+        caps.setup(terminal)
+        if term.output_thread and terminal is term.console:
+            terminal.start_writer()
+
+    renderer = None
+    if prerender_tabs and terminal.prerender and not is_subpage and page_total > 1:
+        # Only loaded here, it brings in the screen emulator
+        import prerender
+
+        renderer = prerender.Prerender(pages_gen, tabs)
+
+    # Prerendered frames are diffed against the mirror, and a congested output
+    # thread repaints from it
+    if not is_subpage and (renderer is not None or terminal.writer is not None):
+        import screen
+
+        terminal.set_mirror(screen.Screen(term.get_size()))
+
     term.clear()
     term.cursor(False)
+    if not is_subpage:
+        term.mouse(True)
 
-    tabs = []
-    for page_gen in pages_gen:
-        page = page_gen()
-        tabs += [page["title"]]
+    while True:
+        set_tab_hits(tabs, is_subpage)
 
-    page_total = len(pages_gen)
+        def redraw():
+            draw_screen(tabs, page_index, is_subpage)
 
-    while True:
-        draw_screen(tabs, page_index, is_subpage)
+        def idle() -> float | None:
+            if renderer is None:
+                return None
+            # The frame is sent, catch up with it before drawing the next ones
+            term.current().sync_mirror()
+            return renderer.step(page_index)
+
+        frame = prerender.get_frame(renderer, page_index) if renderer else None
+        if frame is None:
+            redraw()
+        else:
+            prerender.draw_frame(frame)
 
-        new_index = bios_page(pages_gen[page_index])
+        new_index = bios_page(pages_gen[page_index], redraw, idle, frame is not None)
 
         if not is_subpage:
             if new_index == -1:
@@ -1,7 +1,14 @@
+import time
+
+start_time = time.perf_counter()
+
+import sys
 import bios
 import ami
 import term
 
+import_time = time.perf_counter()
+
 
 def save_exit_confirm(item):
     r = ami.message_box(
@@ -26,7 +33,8 @@ def discard_confirm(item):
         "Discard Changes", "Discard configuration changes?", ["Yes", "No"]
     )
     if r == 0:
-        item["value"] = "OK"
+        # Changed values only live in the session state
+        bios.current_state().reset()
 
 
 exit_page: bios.Page = {
@@ -62,7 +70,11 @@ exit_page: bios.Page = {
 def test_dialog(item):
     r = ami.message_box("Title", "Are you sure to perform?", ["Yes", "No"])
     if r == 0:
-        item["value"] = "Clear"
+        bios.set_value(item, "Clear")
+
+
+def system_time():
+    return time.strftime("%H:%M:%S")
 
 
 hwinfo_page: bios.Page = {
@@ -112,6 +124,8 @@ main_page: bios.Page = {
         {
             "title": "System Time",
             "value": "00:00:00",
+            "provider": system_time,
+            "interval": 1.0,
             "type": "option",
             "level": 0,
             "help": "Set the current system time",
@@ -169,9 +183,107 @@ admin_pages: bios.PageGenerators = [
 ]
 
 
-def main():
-    ami.bios_screen(admin_pages)
+# Functions that schema files can refer to by name
+schema_functions = {
+    "save_exit_confirm": save_exit_confirm,
+    "discard_exit_confirm": discard_exit_confirm,
+    "discard_confirm": discard_confirm,
+    "test_dialog": test_dialog,
+    "system_time": system_time,
+}
+
+
+class FirstFrame(Exception):
+    pass
+
+
+class FirstFrameTerminal(term.Terminal):
+    setup_time = 0.0
+
+    def write(self, text: str):
+        # Nothing is drawn before the terminal is set up
+        if not self.setup_time:
+            self.setup_time = time.perf_counter()
+        super().write(text)
+
+    def read_key(self, timeout: float | None = None) -> str | None:
+        # The first frame is complete once the UI waits for a key and the
+        # output thread has sent it
+        self.flush()
+        self.drain()
+        self.frame_time = time.perf_counter()
+        raise FirstFrame
+
+
+def time_first_frame(pages: bios.PageGenerators, init_time: float, budget: float):
+    terminal = FirstFrameTerminal(None if sys.stdout.isatty() else (80, 25))
+    # Stand in for the console, so probing its capabilities, the output thread
+    # and the mirror are measured as they run for real
+    console = term.console
+    term.console = terminal
+    term.use(terminal)
+
+    # Tabs are prerendered after the first frame, it would only be measured here
+    ami.prerender_tabs = False
+
+    try:
+        ami.bios_screen(pages)
+    except FirstFrame:
+        pass
+
+    term.mouse(False)
+    term.reset()
+    term.clear()
+    term.set_pos((1, 1))
+    term.cursor(True)
+    term.flush()
+    terminal.stop_writer()
+    term.console = console
+
+    phases = [
+        ("import", start_time, import_time),
+        ("init", import_time, init_time),
+        ("setup", init_time, terminal.setup_time),
+        ("render", terminal.setup_time, terminal.frame_time),
+        ("total", start_time, terminal.frame_time),
+    ]
+    for name, start, end in phases:
+        print(f"{name:<8}{(end - start) * 1000:8.2f} ms", file=sys.stderr)
+
+    total = (terminal.frame_time - start_time) * 1000
+    if budget and total > budget:
+        print(f"Time to first frame is over the budget of {budget:g} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+def main(args: list[str] = []):
+    pages = admin_pages
+
+    # --time-to-first-frame[=budget in ms] reports startup phases and exits
+    timing = [a for a in args if a.startswith("--time-to-first-frame")]
+    # --log=path adds an event log page before the Exit page
+    logs = [a for a in args if a.startswith("--log=")]
+    args = [a for a in args if a not in timing and a not in logs]
+
+    # Load menus from a schema file if one is given
+    if args:
+        import schema
+
+        pages = schema.load(args[0], schema_functions)
+
+    if logs:
+        import logview
+
+        log_page = logview.new_log_page_generator("Event Log", logs[0][len("--log=") :])
+        pages = pages[:-1] + [log_page] + pages[-1:]
+
+    if timing:
+        _, _, budget = timing[0].partition("=")
+        time_first_frame(pages, time.perf_counter(), float(budget or 0))
+        return
+
+    ami.bios_screen(pages)
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
@@ -1,4 +1,8 @@
+import contextvars
+import sys
+import types
 from typing import List, Callable, Any, NotRequired, TypedDict
+import live
 
 
 class Item(TypedDict):
@@ -8,11 +12,14 @@ class Item(TypedDict):
     value: NotRequired[Any]
     values: NotRequired[List[Any]]
     function: NotRequired[Callable]
+    provider: NotRequired[Callable[[], Any]]
+    interval: NotRequired[float]
 
 
 class Page(TypedDict):
     title: str
     items: List[Item]
+    log: NotRequired[Any]
 
 
 def get_selectable_index(items: List[Item], offset: int = -1, reverse: bool = False):
@@ -48,7 +55,115 @@ PageGenerators = List[PageGenerator]
 
 
 def new_page_generator(page: Page) -> PageGenerator:
+    frozen = None
+
+    # Freeze the page on first use, tabs only need its title
     def generator() -> Page:
-        return page
+        nonlocal frozen
+        if frozen is None:
+            frozen = freeze_page(page)
+        return frozen
 
+    generator.title = page["title"]
     return generator
+
+
+def get_page_title(page_gen: PageGenerator) -> str:
+    if hasattr(page_gen, "title"):
+        return page_gen.title
+    return page_gen()["title"]
+
+
+# Frozen pages keyed by the identity of their source, and interned values
+_frozen: dict[int, tuple[Page, Page]] = {}
+_interned: dict[Any, Any] = {}
+
+
+def intern_value(value: Any) -> Any:
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        value = tuple(intern_value(v) for v in value)
+        return _interned.setdefault(value, value)
+    return value
+
+
+def freeze_item(item: Item | None) -> Item | None:
+    if item is None or isinstance(item, types.MappingProxyType):
+        return item
+    return types.MappingProxyType(
+        {sys.intern(k): intern_value(v) for k, v in item.items()}
+    )
+
+
+def freeze_page(page: Page) -> Page:
+    if isinstance(page, types.MappingProxyType):
+        return page
+
+    # Freeze each source page once, later calls share the same tree
+    if id(page) in _frozen:
+        return _frozen[id(page)][1]
+
+    frozen = types.MappingProxyType(
+        {
+            "title": sys.intern(page["title"]),
+            "items": tuple(freeze_item(item) for item in page["items"]),
+        }
+    )
+    # Sessions freezing the same page at once all get the first result
+    return _frozen.setdefault(id(page), (page, frozen))[1]
+
+
+class State:
+    def __init__(self):
+        # Values changed in this session, keyed by item identity
+        self.values: dict[int, tuple[Item, Any]] = {}
+        # Selected item index of each visited page, keyed by its generator,
+        # generators that build a new page on every call keep one entry
+        self.selected: dict[Callable, int] = {}
+        # Bumped on every value change, so frames drawn earlier can be dropped
+        self.version = 0
+
+    def get_value(self, item: Item) -> Any:
+        if id(item) in self.values:
+            return self.values[id(item)][1]
+        return live.get_value(item)
+
+    def set_value(self, item: Item, value: Any):
+        self.values[id(item)] = (item, value)
+        self.version += 1
+
+    def reset(self):
+        self.values.clear()
+        self.version += 1
+
+    def get_selected(self, page_gen: Callable, default: int) -> int:
+        return self.selected.get(page_gen, default)
+
+    def set_selected(self, page_gen: Callable, index: int):
+        self.selected[page_gen] = index
+
+
+# State of the process, used when no session state is active
+default_state = State()
+
+_state: contextvars.ContextVar[State] = contextvars.ContextVar(
+    "state", default=default_state
+)
+
+
+def current_state() -> State:
+    return _state.get()
+
+
+def use_state(state: State) -> contextvars.Token:
+    # Bind a session state to the current thread or asyncio task
+    return _state.set(state)
+
+
+def get_value(item: Item) -> Any:
+    return current_state().get_value(item)
+
+
+def set_value(item: Item, value: Any):
+    current_state().set_value(item, value)
@@ -0,0 +1,193 @@
+import json
+import os
+import re
+import sys
+import time
+from typing import TypedDict
+import term
+
+
+class Caps(TypedDict):
+    # Parameters of the primary and secondary device attributes replies
+    da1: list[int]
+    da2: list[int]
+    # Synchronized output (mode 2026) and 24-bit color
+    sync: bool
+    truecolor: bool
+
+
+# Seconds to wait for the terminal to answer
+probe_timeout = 0.2
+
+# Seconds a terminal that didn't answer in time goes without capabilities
+# before it's probed again, it may just have been slow (e.g. over SSH)
+retry_after = 3600
+
+# Bump when the cached fields change so old entries are probed again
+cache_version = 2
+
+# Queries sent when probing, DA1 goes last since every terminal answers it,
+# so its reply means the others have arrived or never will
+queries = (
+    term.ESC + "?2026$p"  # DECRQM, synchronized output
+    + term.ESC + ">c"  # DA2, terminal type and version
+    + term.ESC + "c"  # DA1, device attributes
+)
+
+decrpm_reply = re.compile(r"\033\[\?2026;(\d)\$y")
+da2_reply = re.compile(r"\033\[>([\d;]*)c")
+da1_reply = re.compile(r"\033\[\?([\d;]*)c")
+
+# Capabilities of the process console, probed once
+_console_caps: Caps | None = None
+
+
+def get_cache_path() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "pybios", "caps.json")
+
+
+def get_identity() -> str:
+    # Terminals are told apart by what they put in the environment
+    names = ("TERM", "TERM_PROGRAM", "TERM_PROGRAM_VERSION", "VTE_VERSION")
+    return "|".join(os.environ.get(name, "") for name in names)
+
+
+def is_truecolor() -> bool:
+    return os.environ.get("COLORTERM", "").lower() in ("truecolor", "24bit")
+
+
+def get_params(text: str) -> list[int]:
+    return [int(p) for p in text.split(";") if p.isdigit()]
+
+
+def read_cache() -> dict:
+    try:
+        with open(get_cache_path()) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get("version") != cache_version:
+        return {}
+    return cache
+
+
+def write_cache(identity: str, caps: Caps | None):
+    path = get_cache_path()
+    cache = read_cache()
+    cache["version"] = cache_version
+    terminals = cache.setdefault("terminals", {})
+    timeouts = cache.setdefault("timeouts", {})
+    if caps is None:
+        # Only when it last timed out is kept, not a result
+        timeouts[identity] = time.time()
+    else:
+        terminals[identity] = caps
+        timeouts.pop(identity, None)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Without a cache the terminal is just probed again next time
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def read_replies(terminal: term.Terminal, timeout: float) -> str | None:
+    deadline = time.monotonic() + timeout
+    text = ""
+    while not da1_reply.search(text):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        ch = terminal.getch(remaining)
+        if not ch:
+            return None
+        text += ch
+    return text
+
+
+def probe(terminal: term.Terminal, timeout: float = probe_timeout) -> Caps | None:
+    terminal.flush()
+    terminal.send(queries)
+
+    # Keep the console raw so replies aren't echoed or held until Enter
+    if terminal is term.console:
+        import termios
+        import tty
+
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
+        try:
+            tty.setraw(fd, termios.TCSANOW)
+            text = read_replies(terminal, timeout)
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+    else:
+        text = read_replies(terminal, timeout)
+
+    if text is None:
+        return None
+
+    decrpm = decrpm_reply.search(text)
+    da2 = da2_reply.search(text)
+    da1 = da1_reply.search(text)
+
+    # Keys typed while probing are read as usual afterwards
+    rest = text
+    for match in (decrpm, da2, da1):
+        if match is not None:
+            rest = rest.replace(match.group(0), "", 1)
+    terminal.pending = rest + terminal.pending
+
+    return {
+        "da1": get_params(da1.group(1)),
+        "da2": get_params(da2.group(1)) if da2 else [],
+        # Mode 2026 is set or reset, so the terminal knows it
+        "sync": decrpm is not None and decrpm.group(1) in ("1", "2"),
+        "truecolor": is_truecolor(),
+    }
+
+
+def get_default_caps() -> Caps:
+    return {"da1": [], "da2": [], "sync": False, "truecolor": is_truecolor()}
+
+
+def get_console_caps() -> Caps:
+    global _console_caps
+    if _console_caps is not None:
+        return _console_caps
+
+    if not (sys.stdin.isatty() and sys.stdout.isatty()):
+        _console_caps = get_default_caps()
+        return _console_caps
+
+    identity = get_identity()
+    cache = read_cache()
+    caps = cache.get("terminals", {}).get(identity)
+    timed_out = cache.get("timeouts", {}).get(identity)
+    if caps is None and isinstance(timed_out, (int, float)):
+        # Don't wait on a terminal that timed out recently, it likely will again
+        if 0 <= time.time() - timed_out < retry_after:
+            caps = get_default_caps()
+    if caps is None:
+        caps = probe(term.console)
+        write_cache(identity, caps)
+        caps = caps or get_default_caps()
+
+    _console_caps = caps
+    # The environment decides color depth, it may change between runs
+    _console_caps["truecolor"] = is_truecolor()
+    return _console_caps
+
+
+def setup(terminal: term.Terminal):
+    # Only the console is probed, session terminals keep plain VT100 output
+    if terminal is term.console:
+        terminal.sync_output = get_console_caps()["sync"]
@@ -24,3 +24,7 @@ class Palette(TypedDict):
     selected: Pair
     disabled: Pair
     shadow: Pair
+
+
+def get_palette_key(palette: Palette) -> tuple:
+    return tuple(palette.items())
@@ -0,0 +1,280 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+from typing import Any, TextIO, TypedDict
+import bios
+
+
+# Settings are select items, keyed by the titles of the pages leading to them
+key_separator = "/"
+
+# Value shown for settings an export has a value for that isn't in values
+invalid_value = "<invalid>"
+
+
+class HostReport(TypedDict):
+    host: str
+    # Setting key to (value on the host, value in the reference)
+    differences: dict[str, tuple[Any, Any]]
+    # Settings of the reference the host has no value for
+    missing: list[str]
+    # Settings of the host that the page tree doesn't have
+    unknown: list[str]
+    error: str
+
+
+def get_settings(pages: bios.PageGenerators) -> dict[str, bios.Item]:
+    settings: dict[str, bios.Item] = {}
+    visited: set[int] = set()
+
+    def walk(page: bios.Page, prefix: str):
+        if id(page) in visited:
+            return
+        visited.add(id(page))
+
+        for item in page["items"]:
+            if not item:
+                continue
+            key = prefix + key_separator + item["title"]
+            if item.get("type") == "select":
+                # Exports couldn't tell the two apart, so neither could be compared
+                if key in settings:
+                    raise ValueError(f"two settings are named '{key}'")
+                settings[key] = item
+            elif "subpage" in item:
+                walk(item["subpage"](), key)
+
+    for page_gen in pages:
+        page = page_gen()
+        walk(page, page["title"])
+    return settings
+
+
+def export_settings(settings: dict[str, bios.Item]) -> dict[str, Any]:
+    # Values are exported by name, so reordering values keeps exports valid
+    return {key: item["values"][bios.get_value(item)] for key, item in settings.items()}
+
+
+def normalize(value: Any, values: tuple) -> Any:
+    # Exports may hold the index of a value or its name in any case
+    if isinstance(value, int) and not isinstance(value, bool):
+        if 0 <= value < len(values):
+            return values[value]
+        return invalid_value
+    if isinstance(value, str):
+        folded = value.strip().casefold()
+        for v in values:
+            if str(v).casefold() == folded:
+                return v
+    return invalid_value
+
+
+# Values and reference values of each setting, set in each worker process
+_values: dict[str, tuple] = {}
+_reference: dict[str, Any] = {}
+
+
+def init_worker(values: dict[str, tuple], reference: dict[str, Any]):
+    global _values, _reference
+    _values = values
+    _reference = reference
+
+
+def compare_host(path: str) -> HostReport:
+    host = os.path.splitext(os.path.basename(path))[0]
+    report: HostReport = {
+        "host": host,
+        "differences": {},
+        "missing": [],
+        "unknown": [],
+        "error": "",
+    }
+
+    try:
+        with open(path, "rb") as f:
+            exported = json.load(f)
+        if not isinstance(exported, dict):
+            raise ValueError("export must be an object")
+    except (OSError, ValueError) as e:
+        report["error"] = getattr(e, "strerror", None) or str(e)
+        return report
+
+    for key, expected in _reference.items():
+        if key not in exported:
+            report["missing"].append(key)
+            continue
+        value = normalize(exported[key], _values[key])
+        if value != expected:
+            report["differences"][key] = (value, expected)
+
+    report["unknown"] = [key for key in exported if key not in _values]
+    return report
+
+
+def get_export_paths(directory: str):
+    # Yielded lazily, the directory may hold many thousands of exports
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".json") and entry.is_file():
+                yield entry.path
+
+
+def print_host(report: HostReport):
+    if report["error"]:
+        print(f"{report['host']}: error: {report['error']}", flush=True)
+        return
+
+    count = len(report["differences"]) + len(report["missing"])
+    if not count:
+        return
+    print(f"{report['host']}: {count} settings differ", flush=True)
+    for key, (value, expected) in report["differences"].items():
+        print(f"    {key} = {value} (expected {expected})", flush=True)
+    for key in report["missing"]:
+        print(f"    {key} missing", flush=True)
+
+
+def print_settings(settings: dict[str, dict[Any, int]], reference: dict[str, Any]):
+    for key, counts in settings.items():
+        if not counts:
+            continue
+        total = sum(counts.values())
+        values = ", ".join(
+            f"{value} {count}"
+            for value, count in sorted(counts.items(), key=lambda c: -c[1])
+        )
+        print(f"{key}: {total} hosts differ from {reference[key]} ({values})")
+
+
+def compare(
+    reference: dict[str, Any],
+    values: dict[str, tuple],
+    directory: str,
+    report: TextIO | None = None,
+    workers: int | None = None,
+) -> int:
+    # Per setting, how many hosts have each value other than the reference,
+    # this stays the same size however many hosts there are
+    settings: dict[str, dict[Any, int]] = {key: {} for key in reference}
+    hosts = 0
+    differing = 0
+    errors = 0
+
+    pool = multiprocessing.Pool(workers, init_worker, (values, reference))
+    try:
+        for host in pool.imap_unordered(
+            compare_host, get_export_paths(directory), chunksize=16
+        ):
+            hosts += 1
+            if host["error"]:
+                errors += 1
+            elif host["differences"] or host["missing"]:
+                differing += 1
+
+            for key, (value, expected) in host["differences"].items():
+                counts = settings[key]
+                counts[value] = counts.get(value, 0) + 1
+            for key in host["missing"]:
+                counts = settings[key]
+                counts["<missing>"] = counts.get("<missing>", 0) + 1
+
+            print_host(host)
+            # Hosts are written as they come in, one JSON object per line
+            if report is not None:
+                report.write(json.dumps(host) + "\n")
+
+        print()
+        print_settings(settings, reference)
+        print(f"{hosts} hosts, {differing} differ, {errors} unreadable")
+
+        if report is not None:
+            summary = {"hosts": hosts, "differing": differing, "errors": errors}
+            summary["settings"] = {
+                key: {"reference": reference[key], "values": list(counts.items())}
+                for key, counts in settings.items()
+            }
+            report.write(json.dumps({"summary": summary}) + "\n")
+    finally:
+        pool.close()
+        pool.join()
+
+    return differing + errors
+
+
+def load_reference(path: str | None, settings: dict[str, bios.Item]) -> dict[str, Any]:
+    # Without a reference export, the defaults of the page tree are golden
+    reference = export_settings(settings)
+    if path is None:
+        return reference
+
+    with open(path, "rb") as f:
+        exported = json.load(f)
+    if not isinstance(exported, dict):
+        raise ValueError(f"{path}: reference must be an object")
+
+    # A typo here would mark every host as different, refuse it instead
+    for key, value in exported.items():
+        if key not in settings:
+            raise ValueError(f"{path}: unknown setting '{key}'")
+        reference[key] = normalize(value, tuple(settings[key]["values"]))
+        if reference[key] == invalid_value:
+            raise ValueError(f"{path}: '{key}' has no value {value!r}")
+    return reference
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export settings or compare exports of many hosts"
+    )
+    parser.add_argument("--module", default="ami_test", help="module with the pages")
+    parser.add_argument("--pages", default="admin_pages", help="page generator list")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="export the default settings")
+    export.add_argument("path")
+
+    diff = commands.add_parser("diff", help="compare a directory of exports")
+    diff.add_argument("directory")
+    diff.add_argument("--reference", help="export to compare against")
+    diff.add_argument("--report", help="write a JSON lines report here")
+    diff.add_argument("--workers", type=int, help="processes, all cores by default")
+    args = parser.parse_args()
+
+    pages = getattr(importlib.import_module(args.module), args.pages)
+    try:
+        settings = get_settings(pages)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.command == "export":
+        with open(args.path, "w") as f:
+            json.dump(export_settings(settings), f, indent=4)
+            f.write("\n")
+        return
+
+    # Fail here rather than from inside the worker pool
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory}: not a directory")
+    if not os.access(args.directory, os.R_OK | os.X_OK):
+        parser.error(f"{args.directory}: permission denied")
+
+    try:
+        reference = load_reference(args.reference, settings)
+        report = open(args.report, "w") if args.report else None
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    values = {key: tuple(item["values"]) for key, item in settings.items()}
+    try:
+        failed = compare(reference, values, args.directory, report, args.workers)
+    finally:
+        if report is not None:
+            report.close()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import Any, Callable
+
+
+Provider = Callable[[], Any]
+
+# Refresh interval used by items that declare a provider but no interval
+default_interval = 1.0
+
+# Shortest refresh interval, items defined in code may ask for zero or less,
+# which would have the UI refresh them without ever waiting for keys
+min_interval = 0.05
+
+# Providers aren't called while pinned, items show their static value, so
+# recorded and replayed sessions draw the same screens
+pinned = False
+
+# Entries not refreshed for this many seconds after they expired belong to
+# items no longer shown anywhere, they are dropped on the next sweep
+stale_after = 10.0
+
+# Cached values keyed by item identity: (item, value, expiry time), the item
+# is kept so its id can't be reused by another item while the entry exists
+_cache: dict[int, tuple[dict, Any, float]] = {}
+_lock = threading.Lock()
+_next_sweep = 0.0
+
+
+def is_live(item: dict | None) -> bool:
+    return bool(item) and "provider" in item and not pinned
+
+
+def get_interval(item: dict) -> float:
+    return max(item.get("interval", default_interval), min_interval)
+
+
+def get_value(item: dict, now: float | None = None) -> Any:
+    if not is_live(item):
+        return item.get("value")
+
+    if now is None:
+        now = time.monotonic()
+
+    with _lock:
+        entry = _cache.get(id(item))
+        if entry is not None and entry[2] > now:
+            return entry[1]
+
+    # Call the provider outside the lock, it may be slow
+    value = item["provider"]()
+
+    with _lock:
+        _cache[id(item)] = (item, value, now + get_interval(item))
+        if now >= _next_sweep:
+            sweep(now)
+
+    return value
+
+
+def sweep(now: float):
+    # Callers hold the lock, visible items are refreshed as soon as they expire
+    global _next_sweep
+    for key in [k for k, entry in _cache.items() if entry[2] + stale_after < now]:
+        del _cache[key]
+    _next_sweep = now + stale_after
+
+
+def get_entry(item: dict) -> tuple[dict, Any, float] | None:
+    with _lock:
+        return _cache.get(id(item))
+
+
+def get_expiry(item: dict) -> float:
+    entry = get_entry(item)
+    return entry[2] if entry is not None else 0.0
+
+
+def next_deadline(items: list[dict | None]) -> float | None:
+    deadline = None
+    for item in items:
+        if is_live(item):
+            expiry = get_expiry(item)
+            deadline = expiry if deadline is None else min(deadline, expiry)
+    return deadline
+
+
+def get_timeout(items: list[dict | None], now: float | None = None) -> float | None:
+    deadline = next_deadline(items)
+    if deadline is None:
+        return None
+
+    if now is None:
+        now = time.monotonic()
+
+    return max(0.0, deadline - now)
+
+
+def refresh(items: list[dict | None], now: float | None = None) -> list[int]:
+    if now is None:
+        now = time.monotonic()
+
+    # Refresh expired items only, return indexes of values that changed
+    changed = []
+    for i, item in enumerate(items):
+        if not is_live(item) or get_expiry(item) > now:
+            continue
+
+        entry = get_entry(item)
+        old = entry[1] if entry is not None else None
+
+        if get_value(item, now) != old:
+            changed.append(i)
+
+    return changed
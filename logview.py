@@ -0,0 +1,179 @@
+import array
+import mmap
+import os
+import threading
+import bios
+
+
+# Every checkpoint_lines-th line start is indexed, lines in between are
+# found by scanning forward from the nearest checkpoint
+checkpoint_lines = 64
+
+# Bytes indexed per step, released from memory once scanned
+chunk_size = 4 * 1024 * 1024
+
+# Seconds between checks for data appended to the file
+poll_interval = 0.5
+
+
+class LogFile:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.mm: mmap.mmap | None = None
+        self.mapped = 0
+        # Offsets of lines 0, checkpoint_lines, 2 * checkpoint_lines, ...
+        self.checkpoints = array.array("Q", [0])
+        # Complete lines counted so far and the bytes they cover
+        self.lines = 0
+        self.indexed = 0
+        self.indexing = True
+        self.error = ""
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None or self.error:
+                return
+            try:
+                self.file = open(self.path, "rb")
+                # Map the file right away so the first lines show before indexing
+                self.remap(os.fstat(self.file.fileno()).st_size)
+            except OSError as e:
+                self.error = e.strerror or str(e)
+                self.indexing = False
+                return
+            self.thread = threading.Thread(target=self.index_loop, daemon=True)
+        self.thread.start()
+
+    def remap(self, size: int):
+        # Callers hold the lock, an mmap can't grow so map the file again
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if size:
+            self.mm = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        self.mapped = size
+
+    def reset(self):
+        self.checkpoints = array.array("Q", [0])
+        self.lines = 0
+        self.indexed = 0
+
+    def index_chunk(self, end: int) -> bool:
+        with self.lock:
+            mm = self.mm
+            start = self.indexed
+        stop = min(end, start + chunk_size)
+        lines = self.lines
+        found = []
+
+        pos = mm.find(b"\n", start, stop)
+        while pos != -1:
+            lines += 1
+            if lines % checkpoint_lines == 0:
+                found.append(pos + 1)
+            pos = mm.find(b"\n", pos + 1, stop)
+
+        with self.lock:
+            if self.mm is not mm:
+                return True
+            self.checkpoints.extend(found)
+            self.lines = lines
+            self.indexed = stop
+
+        # Drop the scanned pages, they are read back from the file if shown
+        page = mmap.PAGESIZE
+        begin = start // page * page
+        if stop - begin > page and hasattr(mmap, "MADV_DONTNEED"):
+            mm.madvise(mmap.MADV_DONTNEED, begin, (stop - begin) // page * page)
+        return stop < end
+
+    def index_loop(self):
+        event = threading.Event()
+        while True:
+            size = os.fstat(self.file.fileno()).st_size
+
+            with self.lock:
+                if size < self.mapped:
+                    # The log was truncated or rotated in place
+                    self.reset()
+                    self.remap(size)
+                elif size > self.mapped:
+                    self.remap(size)
+
+            if self.mm is not None and self.indexed < size:
+                self.indexing = True
+                while self.index_chunk(size):
+                    pass
+                continue
+
+            self.indexing = False
+            event.wait(poll_interval)
+
+    def get_line_count(self) -> int:
+        with self.lock:
+            # A last line without a newline is counted once indexing is done
+            if self.mm is not None and self.indexed == self.mapped:
+                if self.mm[self.mapped - 1] != ord("\n"):
+                    return self.lines + 1
+            return self.lines
+
+    def get_lines(self, start: int, count: int) -> list[str]:
+        with self.lock:
+            mm = self.mm
+            if mm is None or start < 0:
+                return []
+            checkpoint = min(start // checkpoint_lines, len(self.checkpoints) - 1)
+            pos = self.checkpoints[checkpoint]
+            end_of_data = self.mapped
+
+            # Skip to the first requested line from the nearest checkpoint
+            for i in range(start - checkpoint * checkpoint_lines):
+                pos = mm.find(b"\n", pos, end_of_data)
+                if pos == -1:
+                    return []
+                pos += 1
+
+            lines = []
+            while len(lines) < count and pos < end_of_data:
+                end = mm.find(b"\n", pos, end_of_data)
+                if end == -1:
+                    end = end_of_data
+                lines.append(decode_line(mm[pos:end]))
+                pos = end + 1
+            return lines
+
+
+def decode_line(data: bytes) -> str:
+    text = data.decode("utf-8", "replace").rstrip("\r").expandtabs(8)
+    return "".join(ch if ch.isprintable() else "?" for ch in text)
+
+
+# Log files are shared by every session that shows them
+_logs: dict[str, LogFile] = {}
+_logs_lock = threading.Lock()
+
+
+def get_log(path: str) -> LogFile:
+    path = os.path.abspath(path)
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = LogFile(path)
+        log = _logs[path]
+    log.start()
+    return log
+
+
+def new_log_page_generator(title: str, path: str) -> bios.PageGenerator:
+    log = None
+
+    def generator() -> bios.Page:
+        nonlocal log
+        if log is None:
+            log = get_log(path)
+        return {"title": title, "items": [], "log": log}
+
+    generator.title = title
+    return generator
@@ -0,0 +1,166 @@
+import threading
+from typing import Any
+import term
+import color
+import bios
+import screen
+import ami
+
+
+# Threads that call page generators for tabs being prerendered
+workers = 2
+
+# Seconds between checks for pages generated on a worker thread
+poll_interval = 0.02
+
+def is_idle_poll(timeout: float | None) -> bool:
+    # Scripted terminals answer these with no key, so each scripted key is only
+    # read once the tabs around it are drawn, however the threads are timed
+    return timeout is not None and timeout <= poll_interval
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Only needed once a tab is prerendered, keep it out of startup
+            from concurrent.futures import ThreadPoolExecutor
+
+            _executor = ThreadPoolExecutor(workers, "prerender")
+    return _executor
+
+
+class FrameReady(Exception):
+    pass
+
+
+class FrameTerminal(screen.ScreenTerminal):
+    def read_key(self, timeout: float | None = None) -> str | None:
+        # The page is drawn once it waits for a key
+        self.flush()
+        raise FrameReady
+
+
+Frame = tuple[screen.Screen, bios.Page, int]
+
+
+def render_frame(
+    page_gen: bios.PageGenerator,
+    page: bios.Page,
+    tabs: list[str],
+    page_index: int,
+    size: term.Size,
+) -> Frame:
+    # Remember the selection the frame was drawn with
+    items = page["items"]
+    selected = bios.current_state().get_selected(
+        page_gen, bios.get_selectable_index(items)
+    )
+
+    terminal = FrameTerminal(size)
+    token = term.use(terminal)
+    try:
+        ami.draw_screen(tabs, page_index)
+        ami.bios_page(lambda: page, selection_key=page_gen)
+    except FrameReady:
+        pass
+    finally:
+        term.release(token)
+    return terminal.screen, page, selected
+
+
+class Prerender:
+    def __init__(self, pages_gen: bios.PageGenerators, tabs: list[str]):
+        self.pages_gen = pages_gen
+        self.tabs = tabs
+        # Pages being generated and frames drawn by page index, with the key
+        # they were started for
+        self.pages: dict[int, tuple[tuple, Any]] = {}
+        self.frames: dict[int, tuple[tuple, Frame | None]] = {}
+
+    def get_key(self) -> tuple:
+        return (
+            term.get_size(),
+            bios.current_state().version,
+            color.get_palette_key(ami.header_palette),
+            color.get_palette_key(ami.screen_palette),
+        )
+
+    def step(self, page_index: int) -> float | None:
+        last = len(self.pages_gen) - 1
+        neighbours = dict.fromkeys([page_index + 1, page_index - 1, last])
+        wanted = [i for i in neighbours if 0 <= i <= last and i != page_index]
+        key = self.get_key()
+
+        # Drop work for pages that aren't adjacent anymore or went stale
+        for index in list(self.pages):
+            if index not in wanted or self.pages[index][0] != key:
+                self.pages.pop(index)[1].cancel()
+        for index in list(self.frames):
+            if index not in wanted or self.frames[index][0] != key:
+                del self.frames[index]
+
+        wait = None
+        for index in wanted:
+            if index in self.frames:
+                continue
+
+            # Generators may be slow, call them on a worker thread
+            if index not in self.pages:
+                future = get_executor().submit(self.pages_gen[index])
+                self.pages[index] = (key, future)
+            future = self.pages[index][1]
+            if not future.done():
+                wait = poll_interval
+                continue
+
+            # Draw one frame per step so keys are read in between
+            del self.pages[index]
+            frame = None
+            if future.exception() is None:
+                page_gen = self.pages_gen[index]
+                page = future.result()
+                frame = render_frame(page_gen, page, self.tabs, index, key[0])
+            self.frames[index] = (key, frame)
+            return 0
+        return wait
+
+    def take(self, page_index: int) -> screen.Screen | None:
+        entry = self.frames.pop(page_index, None)
+        if entry is None or entry[1] is None or entry[0] != self.get_key():
+            return None
+
+        # Generators that build a new page each time can't be prerendered
+        frame, page, selected = entry[1]
+        page_gen = self.pages_gen[page_index]
+        if page_gen() is not page:
+            return None
+        if bios.current_state().get_selected(page_gen, selected) != selected:
+            return None
+        return frame
+
+
+def get_frame(prerender: Prerender, page_index: int) -> screen.Screen | None:
+    terminal = term.current()
+    size = term.get_size()
+
+    # The screen contents aren't known after a resize, start over
+    if terminal.mirror is None or terminal.mirror.get_size() != size:
+        terminal.set_mirror(screen.Screen(size))
+        term.clear()
+        return None
+    return prerender.take(page_index)
+
+
+def draw_frame(frame: screen.Screen):
+    terminal = term.current()
+
+    # The mirror only sees output once it's flushed
+    terminal.flush(False)
+    terminal.sync_mirror()
+    terminal.write(terminal.mirror.diff(frame))
+    terminal.pen = None
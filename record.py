@@ -0,0 +1,222 @@
+import argparse
+import importlib
+import json
+import sys
+import time
+import live
+import prerender
+import term
+from screen import Screen, ScreenTerminal
+
+
+# Byte sequences sent by a VT100 terminal for the keys decoded by term.read_key
+key_sequences = {"ESC": "\x1b", "ENTER": "\r", "BACKSPACE": "\x7f"}
+for seq, key in term.csi_keys.items():
+    key_sequences.setdefault(key, "\x1b[" + seq)
+
+
+class ReplayFinished(Exception):
+    pass
+
+
+class Recorder:
+    def __init__(self):
+        self.size = term.get_size()
+        self.timestamp = time.time()
+        self.events: list[list] = []
+        self._start = time.monotonic()
+        self._terminal = term.current()
+        self._send = self._terminal.send
+        self._read_key = term.read_key
+
+    def elapsed(self) -> float:
+        return round(time.monotonic() - self._start, 6)
+
+    def send(self, data: str):
+        self.events.append([self.elapsed(), "o", data])
+        self._send(data)
+
+    def read_key(self, timeout: float | None = None) -> str | None:
+        key = self._read_key(timeout)
+        # Mouse events are kept as the report the terminal sent
+        data = term.encode_mouse(term.get_mouse()) if key == "MOUSE" else key
+        self.events.append([self.elapsed(), "k", data])
+        return key
+
+    def start(self):
+        self._terminal.send = self.send
+        term.read_key = self.read_key
+        live.pinned = True
+
+    def stop(self):
+        self._terminal.send = self._send
+        term.read_key = self._read_key
+        live.pinned = False
+
+    def header(self) -> dict:
+        w, h = self.size
+        return {"width": w, "height": h, "timestamp": self.timestamp}
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            f.write(json.dumps(self.header()) + "\n")
+            for event in self.events:
+                f.write(json.dumps(event) + "\n")
+
+
+def load(path: str) -> tuple[dict, list[list]]:
+    with open(path) as f:
+        header = json.loads(f.readline())
+        events = [json.loads(line) for line in f if line.strip()]
+    return header, events
+
+
+def export_asciicast(path: str, out_path: str):
+    header, events = load(path)
+
+    with open(out_path, "w") as f:
+        f.write(json.dumps({"version": 2, **header}) + "\n")
+        for t, kind, data in events:
+            if kind == "o":
+                f.write(json.dumps([t, "o", data]) + "\n")
+            elif data is not None:
+                f.write(json.dumps([t, "i", key_sequences.get(data, data)]) + "\n")
+
+
+def recorded_screen(header: dict, events: list[list]) -> Screen:
+    # The screen as the last key was read, exiting clears it afterwards
+    last = max(
+        (i for i, (t, kind, data) in enumerate(events) if kind == "k" and data),
+        default=len(events),
+    )
+    screen = Screen((header["width"], header["height"]))
+    for t, kind, data in events[:last]:
+        if kind == "o":
+            screen.feed(data)
+    return screen
+
+
+def run(module: str):
+    try:
+        importlib.import_module(module).main()
+    except SystemExit:
+        pass
+
+
+def record(path: str, module: str):
+    recorder = Recorder()
+    recorder.start()
+    try:
+        run(module)
+    finally:
+        recorder.stop()
+        recorder.save(path)
+
+
+class ReplayTerminal(ScreenTerminal):
+    def __init__(self, size: term.Size, keys: list[str | None]):
+        super().__init__(size)
+        self.keys = keys
+        self.frames = 0
+        self.bytes = 0
+        self.final: Screen | None = None
+
+    def send(self, data: str):
+        self.bytes += len(data.encode())
+        super().send(data)
+
+    def read_key(self, timeout: float | None = None) -> str | None:
+        self.flush()
+        if self.prerender and prerender.is_idle_poll(timeout):
+            time.sleep(timeout)
+            return None
+        if self.frames == len(self.keys):
+            raise ReplayFinished
+        if self.frames == len(self.keys) - 1:
+            self.final = self.screen.copy()
+        key = self.keys[self.frames]
+        self.frames += 1
+        # Recorded mouse reports hit the regions of the replayed frame
+        if key is not None and key.startswith(term.mouse_prefix):
+            return self.set_mouse(*term.decode_mouse(key))
+        return key
+
+
+def replay(path: str, module: str, prerender_tabs: bool = False) -> dict:
+    header, events = load(path)
+    size = header["width"], header["height"]
+    # Read timeouts only refresh live values, which are pinned, so only keys
+    # are replayed and counted as frames
+    keys = [data for t, kind, data in events if kind == "k" and data]
+
+    terminal = ReplayTerminal(size, keys)
+    terminal.prerender = prerender_tabs
+    token = term.use(terminal)
+
+    start = time.perf_counter()
+    live.pinned = True
+    try:
+        run(module)
+    except ReplayFinished:
+        pass
+    finally:
+        live.pinned = False
+        term.release(token)
+    elapsed = time.perf_counter() - start
+
+    frames = max(terminal.frames, 1)
+    final = terminal.final or terminal.screen
+    mismatched = final.diff_rows(recorded_screen(header, events))
+
+    return {
+        "frames": terminal.frames,
+        "bytes": terminal.bytes,
+        "seconds": elapsed,
+        "frames_per_second": terminal.frames / elapsed if elapsed else 0.0,
+        "bytes_per_frame": terminal.bytes / frames,
+        "match": not mismatched,
+        "mismatched_rows": mismatched,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay PyBIOS sessions")
+    parser.add_argument("--module", default="ami_test", help="module with main()")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("record", help="record a session")
+    cmd.add_argument("log")
+
+    cmd = commands.add_parser("replay", help="replay a session and benchmark it")
+    cmd.add_argument("log")
+    cmd.add_argument(
+        "--prerender", action="store_true", help="prerender tabs like the console"
+    )
+
+    cmd = commands.add_parser("cast", help="export a session as asciicast v2")
+    cmd.add_argument("log")
+    cmd.add_argument("cast")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.log, args.module)
+    elif args.command == "cast":
+        export_asciicast(args.log, args.cast)
+    else:
+        result = replay(args.log, args.module, args.prerender)
+        print(
+            f"{result['frames']} frames in {result['seconds']:.3f}s: "
+            f"{result['frames_per_second']:.1f} frames/s, "
+            f"{result['bytes_per_frame']:.0f} bytes/frame"
+        )
+        if result["match"]:
+            print("Final screen matches the recording")
+        else:
+            rows = ", ".join(map(str, result["mismatched_rows"]))
+            print(f"Final screen differs from the recording on rows {rows}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
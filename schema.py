@@ -0,0 +1,233 @@
+import hashlib
+import json
+import marshal
+import os
+from typing import Any, Callable
+import bios
+
+
+# Bump when the compiled layout or validation changes so stale caches are rebuilt
+cache_version = 3
+cache_magic = b"PYBIOS"
+cache_suffix = ".cache"
+
+item_types = ("option", "select", "subpage")
+item_keys = {
+    "title": str,
+    "type": str,
+    "help": str,
+    "values": list,
+    "subpage": str,
+    "function": str,
+    "provider": str,
+    "interval": (int, float),
+    "level": int,
+}
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def parse(data: bytes, path: str) -> dict:
+    if path.endswith(".toml"):
+        import tomllib
+
+        return tomllib.loads(data.decode())
+    return json.loads(data)
+
+
+def validate_item(item: Any, where: str, page_ids: set[str]) -> dict | None:
+    # Separators are null in JSON and empty tables in TOML
+    if item is None or item == {}:
+        return None
+
+    if not isinstance(item, dict):
+        raise SchemaError(f"{where}: item must be an object")
+
+    for key, value in item.items():
+        if key == "value":
+            continue
+        if key not in item_keys:
+            raise SchemaError(f"{where}: unknown key '{key}'")
+        # Booleans are ints too, but true isn't a level or an interval
+        if isinstance(value, bool) or not isinstance(value, item_keys[key]):
+            raise SchemaError(f"{where}: '{key}' has the wrong type")
+
+    if "title" not in item:
+        raise SchemaError(f"{where}: missing title")
+
+    kind = item.get("type")
+    if kind is not None and kind not in item_types:
+        raise SchemaError(f"{where}: unknown type '{kind}'")
+
+    if kind == "select":
+        values = item.get("values")
+        if not values:
+            raise SchemaError(f"{where}: select item needs a list of values")
+        value = item.get("value", 0)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise SchemaError(f"{where}: value must index into values")
+        if not 0 <= value < len(values):
+            raise SchemaError(f"{where}: value must index into values")
+        item = {**item, "value": value}
+
+    if kind == "subpage" and "subpage" not in item:
+        raise SchemaError(f"{where}: subpage item needs a subpage")
+
+    # An interval of zero or less would refresh the value on every loop
+    if "interval" in item and item["interval"] <= 0:
+        raise SchemaError(f"{where}: interval must be positive")
+
+    # Interned strings are stored once in the compiled cache
+    item = {bios.intern_value(k): bios.intern_value(v) for k, v in item.items()}
+
+    if "subpage" in item:
+        if item["subpage"] not in page_ids:
+            raise SchemaError(f"{where}: unknown subpage '{item['subpage']}'")
+
+    return item
+
+
+def validate(tree: dict) -> dict:
+    pages = tree.get("pages")
+    if not isinstance(pages, list) or not pages:
+        raise SchemaError("schema needs a list of pages")
+
+    page_ids = set()
+    for i, page in enumerate(pages):
+        if not isinstance(page, dict) or not isinstance(page.get("id"), str):
+            raise SchemaError(f"pages[{i}]: page needs a string id")
+        if page["id"] in page_ids:
+            raise SchemaError(f"pages[{i}]: duplicate page id '{page['id']}'")
+        page_ids.add(page["id"])
+
+    compiled = {}
+    for i, page in enumerate(pages):
+        if not isinstance(page.get("title"), str):
+            raise SchemaError(f"pages[{i}]: missing title")
+        if not isinstance(page.get("items"), list):
+            raise SchemaError(f"pages[{i}]: missing items")
+
+        compiled[bios.intern_value(page["id"])] = {
+            "title": bios.intern_value(page["title"]),
+            "items": [
+                validate_item(item, f"pages[{i}].items[{j}]", page_ids)
+                for j, item in enumerate(page["items"])
+            ],
+        }
+
+    # Tabs default to every page that isn't used as a subpage
+    subpages = {
+        item["subpage"]
+        for page in compiled.values()
+        for item in page["items"]
+        if item and "subpage" in item
+    }
+    tabs = tree.get("tabs", [key for key in compiled if key not in subpages])
+    if not isinstance(tabs, list) or not all(isinstance(key, str) for key in tabs):
+        raise SchemaError("tabs must be a list of page ids")
+    for key in tabs:
+        if key not in compiled:
+            raise SchemaError(f"tabs: unknown page '{key}'")
+
+    return {"pages": compiled, "tabs": [bios.intern_value(key) for key in tabs]}
+
+
+def get_cache_path(path: str) -> str:
+    return path + cache_suffix
+
+
+def get_cache_key(data: bytes) -> bytes:
+    return hashlib.sha256(cache_version.to_bytes(2, "little") + data).digest()
+
+
+def read_cache(path: str, key: bytes) -> dict | None:
+    header = cache_magic + key
+    try:
+        with open(get_cache_path(path), "rb") as f:
+            if f.read(len(header)) != header:
+                return None
+            return marshal.loads(f.read())
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+
+
+def write_cache(path: str, key: bytes, compiled: dict):
+    cache_path = get_cache_path(path)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(cache_magic + key + marshal.dumps(compiled))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # A read-only location only costs the cache, not the menu
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def compile_schema(path: str) -> dict:
+    with open(path, "rb") as f:
+        data = f.read()
+
+    key = get_cache_key(data)
+    compiled = read_cache(path, key)
+    if compiled is None:
+        compiled = validate(parse(data, path))
+        write_cache(path, key, compiled)
+    return compiled
+
+
+def build(compiled: dict, functions: dict[str, Callable] = {}) -> bios.PageGenerators:
+    pages: dict[str, bios.Page] = {}
+    generators: dict[str, bios.PageGenerator] = {}
+
+    def resolve(name: str, where: str) -> Callable:
+        if name not in functions:
+            raise SchemaError(f"{where}: unknown function '{name}'")
+        return functions[name]
+
+    def build_page(key: str) -> bios.Page:
+        page = compiled["pages"][key]
+        items = []
+        for item in page["items"]:
+            if item is not None:
+                item = dict(item)
+                where = f"{key}: {item['title']}"
+                if "subpage" in item:
+                    item["subpage"] = get_generator(item["subpage"])
+                if "function" in item:
+                    item["function"] = resolve(item["function"], where)
+                if "provider" in item:
+                    item["provider"] = resolve(item["provider"], where)
+            items.append(item)
+        return bios.freeze_page({"title": page["title"], "items": items})
+
+    # Pages are built on first use, but unknown names are reported right away
+    for key, page in compiled["pages"].items():
+        for item in page["items"]:
+            for name in ("function", "provider"):
+                if item and name in item:
+                    resolve(item[name], f"{key}: {item['title']}")
+
+    # Subpages may be referenced before their page is built
+    def get_generator(key: str) -> bios.PageGenerator:
+        if key not in generators:
+
+            def generator() -> bios.Page:
+                # Pages may be built from several threads, keep the first one
+                if key not in pages:
+                    pages.setdefault(key, build_page(key))
+                return pages[key]
+
+            generator.title = compiled["pages"][key]["title"]
+            generators[key] = generator
+        return generators[key]
+
+    return [get_generator(key) for key in compiled["tabs"]]
+
+
+def load(path: str, functions: dict[str, Callable] = {}) -> bios.PageGenerators:
+    return build(compile_schema(path), functions)
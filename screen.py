@@ -0,0 +1,279 @@
+import functools
+import re
+import term
+import width
+
+
+# Default SGR colors for cells that were never painted
+default_attr = (49, 39)
+
+Attr = tuple[int, int]
+
+# CSI sequences, other escapes, runs of printable text and single characters
+_tokens = re.compile(
+    r"\033\[([0-?]*)[ -/]*([@-~])|\033[^\[]|([^\x00-\x1f\x7f\033]+)|(.)", re.S
+)
+_final = re.compile(r"[@-~]")
+
+
+@functools.lru_cache(maxsize=1024)
+def is_narrow(text: str) -> bool:
+    return text.isascii() or all(width.char_width(ch) == 1 for ch in text)
+
+
+class Screen:
+    def __init__(self, size: term.Size):
+        self.w, self.h = size
+        self.chars = [" "] * (self.w * self.h)
+        self.attrs = [default_attr] * (self.w * self.h)
+        self.x = 0
+        self.y = 0
+        self.attr = default_attr
+        self.wrap_pending = False
+        self.cursor = True
+        self._pending = ""
+
+    def get_size(self) -> term.Size:
+        return self.w, self.h
+
+    def copy(self) -> "Screen":
+        screen = Screen(self.get_size())
+        screen.chars = self.chars[:]
+        screen.attrs = self.attrs[:]
+        return screen
+
+    def clear(self):
+        self.chars = [" "] * (self.w * self.h)
+        self.attrs = [self.attr] * (self.w * self.h)
+
+    def scroll(self):
+        w = self.w
+        self.chars = self.chars[w:] + [" "] * w
+        self.attrs = self.attrs[w:] + [self.attr] * w
+
+    def put(self, ch: str):
+        cw = width.char_width(ch)
+
+        # Combining characters join the previously written cell
+        if cw == 0:
+            i = self.y * self.w + self.x - (0 if self.wrap_pending else 1)
+            if i > 0 and self.chars[i] == "":
+                i -= 1
+            if i >= 0:
+                self.chars[i] += ch
+            return
+
+        # Wide characters that don't fit on the line wrap first
+        if cw == 2 and self.x == self.w - 1 and not self.wrap_pending:
+            self.put(" ")
+
+        if self.wrap_pending:
+            self.wrap_pending = False
+            self.x = 0
+            if self.y == self.h - 1:
+                self.scroll()
+            else:
+                self.y += 1
+
+        i = self.y * self.w + self.x
+
+        # Overwriting half of a wide character blanks the other half
+        if self.chars[i] == "" and self.x > 0:
+            self.chars[i - 1] = " "
+        if self.x < self.w - 1 and self.chars[i + 1] == "":
+            self.chars[i + 1] = " "
+
+        self.chars[i] = ch
+        self.attrs[i] = self.attr
+
+        # The second column of a wide character holds an empty string
+        if cw == 2:
+            if self.x < self.w - 2 and self.chars[i + 2] == "":
+                self.chars[i + 2] = " "
+            self.x += 1
+            self.chars[i + 1] = ""
+            self.attrs[i + 1] = self.attr
+
+        if self.x == self.w - 1:
+            self.wrap_pending = True
+        else:
+            self.x += 1
+
+    def sgr(self, params: list[int]):
+        bg, fg = self.attr
+        for p in params or [0]:
+            if p == 0:
+                bg, fg = default_attr
+            elif 30 <= p <= 39 or 90 <= p <= 97:
+                fg = p
+            elif 40 <= p <= 49 or 100 <= p <= 107:
+                bg = p
+        self.attr = bg, fg
+
+    def csi(self, params: str, final: str):
+        if params.startswith("?"):
+            if params == "?25":
+                self.cursor = final == "h"
+            return
+
+        args = [int(p) if p.isdigit() else 0 for p in params.split(";")]
+
+        if final == "H":
+            y = args[0] if args[0] else 1
+            x = args[1] if len(args) > 1 and args[1] else 1
+            self.y = min(max(y, 1), self.h) - 1
+            self.x = min(max(x, 1), self.w) - 1
+            self.wrap_pending = False
+        elif final == "m":
+            self.sgr(args if params else [])
+        elif final == "J":
+            if args[0] == 2:
+                self.clear()
+        elif final == "K":
+            start = self.y * self.w + self.x
+            end = (self.y + 1) * self.w
+            self.chars[start:end] = [" "] * (end - start)
+            self.attrs[start:end] = [self.attr] * (end - start)
+
+    def put_narrow(self, text: str):
+        # Copy runs of single column characters a line at a time
+        while text:
+            if self.wrap_pending:
+                self.put(text[0])
+                text = text[1:]
+                continue
+
+            n = min(len(text), self.w - self.x)
+            i = self.y * self.w + self.x
+            end = i + n
+
+            # Overwriting half of a wide character blanks the other half
+            if self.chars[i] == "" and self.x > 0:
+                self.chars[i - 1] = " "
+            if self.x + n < self.w and self.chars[end] == "":
+                self.chars[end] = " "
+
+            self.chars[i:end] = text[:n]
+            self.attrs[i:end] = [self.attr] * n
+
+            if self.x + n == self.w:
+                self.x = self.w - 1
+                self.wrap_pending = True
+            else:
+                self.x += n
+            text = text[n:]
+
+    def feed(self, text: str):
+        # Keep incomplete escape sequences until the rest arrives
+        text = self._pending + text
+        self._pending = ""
+
+        i = text.rfind("\033")
+        if i != -1:
+            tail = text[i:]
+            if len(tail) < 2 or (tail[1] == "[" and not _final.search(tail, 2)):
+                self._pending = tail
+                text = text[:i]
+
+        for match in _tokens.finditer(text):
+            params, final, run, ch = match.groups()
+            if final is not None:
+                self.csi(params, final)
+            elif run is not None:
+                if is_narrow(run):
+                    self.put_narrow(run)
+                else:
+                    for c in run:
+                        self.put(c)
+            elif ch is None:
+                pass
+            elif ch == "\r":
+                self.x = 0
+                self.wrap_pending = False
+            elif ch == "\n":
+                if self.y == self.h - 1:
+                    self.scroll()
+                else:
+                    self.y += 1
+            elif ch >= " ":
+                self.put(ch)
+
+    def lines(self) -> list[str]:
+        w = self.w
+        return ["".join(self.chars[i : i + w]) for i in range(0, w * self.h, w)]
+
+    def text(self) -> str:
+        return "\n".join(self.lines())
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Screen):
+            return NotImplemented
+        return (
+            self.get_size() == other.get_size()
+            and self.chars == other.chars
+            and self.attrs == other.attrs
+        )
+
+    def diff_rows(self, other: "Screen") -> list[int]:
+        w = self.w
+        rows = []
+        for y in range(min(self.h, other.h)):
+            a = slice(y * w, (y + 1) * w)
+            if self.chars[a] != other.chars[a] or self.attrs[a] != other.attrs[a]:
+                rows.append(y + 1)
+        return rows
+
+    def diff(self, other: "Screen", gap: int = 8) -> str:
+        # Output that turns this screen into the other one, rewriting
+        # short runs of equal cells rather than moving the cursor
+        w = self.w
+        out = []
+        attr = None
+        for y in range(min(self.h, other.h)):
+            row = slice(y * w, (y + 1) * w)
+            chars = other.chars[row]
+            attrs = other.attrs[row]
+            if self.chars[row] == chars and self.attrs[row] == attrs:
+                continue
+
+            cells = zip(self.chars[row], chars, self.attrs[row], attrs)
+            changed = [x for x, (a, b, c, d) in enumerate(cells) if a != b or c != d]
+            runs = [[changed[0], changed[0]]]
+            for x in changed[1:]:
+                if x - runs[-1][1] <= gap:
+                    runs[-1][1] = x
+                else:
+                    runs.append([x, x])
+
+            for start, end in runs:
+                # Start on the first column of a wide character
+                if chars[start] == "" and start > 0:
+                    start -= 1
+                out.append(f"\033[{y + 1};{start + 1}H")
+                for x in range(start, end + 1):
+                    if attrs[x] != attr:
+                        attr = attrs[x]
+                        out.append(f"\033[{attr[0]};{attr[1]}m")
+                    out.append(chars[x])
+        return "".join(out)
+
+    def repaint(self) -> str:
+        # Output that draws this screen from scratch and puts the cursor and
+        # colors back, so output that follows continues where it left off
+        bg, fg = self.attr
+        return (
+            "\033[0m\033[2J"
+            + Screen(self.get_size()).diff(self)
+            + f"\033[{self.y + 1};{self.x + 1}H\033[{bg};{fg}m"
+            + ("\033[?25h" if self.cursor else "\033[?25l")
+        )
+
+
+class ScreenTerminal(term.Terminal):
+    # Terminal that draws into an in-memory screen instead of a tty
+    def __init__(self, size: term.Size):
+        super().__init__(size)
+        self.screen = Screen(size)
+
+    def send(self, data: str):
+        self.screen.feed(data)
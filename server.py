@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import fcntl
+import importlib
+import os
+import queue
+import struct
+import termios
+import threading
+import tty
+from typing import Callable
+import term
+import bios
+import ami
+
+
+# Size used when the client can't report its own
+default_size: term.Size = (80, 25)
+
+# Session threads only run the UI loop, they don't need a large stack
+session_stack_size = 256 * 1024
+
+# Bytes a client may leave unread before a session waits for it, output made
+# meanwhile is replaced by a repaint once the session's queue is full. Kept
+# under 4 KiB, the most a PTY reports as unread
+high_water = 2 * 1024
+
+# Seconds between checks of a full buffer
+drain_poll = 0.05
+
+
+class SessionTerminal(term.Terminal):
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        transport: asyncio.WriteTransport,
+        size: term.Size,
+        unread: Callable[[], int] = lambda: 0,
+    ):
+        super().__init__(size)
+        self.loop = loop
+        self.transport = transport
+        # Bytes written past the transport that the client hasn't read yet
+        self.unread = unread
+        self.input: queue.SimpleQueue[str | None] = queue.SimpleQueue()
+
+    def feed(self, data: bytes):
+        text = self.decoder.decode(data)
+        if text:
+            self.input.put(text)
+
+    def close(self):
+        self.input.put(None)
+
+    def send(self, data: str):
+        # Called on the session's output thread, which waits here while the
+        # client isn't reading so the session itself never blocks
+        future = asyncio.run_coroutine_threadsafe(self.deliver(data), self.loop)
+        try:
+            future.result()
+        except RuntimeError:
+            # The event loop is gone, there's no one left to write to
+            pass
+
+    async def deliver(self, data: str):
+        # Wait for the client to catch up first, so at most high_water stale
+        # bytes are left for it whenever it comes back
+        transport = self.transport
+        while transport.get_write_buffer_size() + self.unread() > high_water:
+            if transport.is_closing():
+                return
+            await asyncio.sleep(drain_poll)
+        if not transport.is_closing():
+            transport.write(data.encode())
+
+    def getch(self, timeout: float | None = None) -> str:
+        if self.pending:
+            ch = self.pending[0]
+            self.pending = self.pending[1:]
+            return ch
+
+        try:
+            text = self.input.get(timeout=timeout)
+        except queue.Empty:
+            return ""
+
+        if text is None:
+            # Keep reporting end of input to any later reads
+            self.input.put(None)
+            raise EOFError
+
+        self.pending = text
+        return self.getch()
+
+
+class Server:
+    def __init__(self, pages_gen, size: term.Size = default_size):
+        # Page definitions are shared by every session
+        self.pages_gen = pages_gen
+        self.size = size
+        self.sessions: set[SessionTerminal] = set()
+
+    def run_session(self, terminal: SessionTerminal, done: asyncio.Future):
+        term.use(terminal)
+        bios.use_state(bios.State())
+        # Output goes through a bounded queue, a client that stops reading
+        # gets a repaint when it catches up instead of every frame it missed
+        terminal.start_writer()
+        try:
+            ami.bios_screen(self.pages_gen)
+        except (SystemExit, EOFError):
+            pass
+        finally:
+            terminal.flush()
+            terminal.stop_writer()
+            terminal.loop.call_soon_threadsafe(done.set_result, None)
+
+    def start_session(
+        self,
+        transport: asyncio.WriteTransport,
+        size: term.Size,
+        unread: Callable[[], int] = lambda: 0,
+    ) -> tuple[SessionTerminal, asyncio.Future]:
+        loop = asyncio.get_running_loop()
+        terminal = SessionTerminal(loop, transport, size, unread)
+        done = loop.create_future()
+
+        thread = threading.Thread(
+            target=self.run_session, args=(terminal, done), daemon=True
+        )
+        self.sessions.add(terminal)
+        thread.start()
+        return terminal, done
+
+    async def handle_stream(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        terminal, done = self.start_session(writer.transport, self.size)
+
+        async def pump():
+            while data := await reader.read(1024):
+                terminal.feed(data)
+            terminal.close()
+
+        pump_task = asyncio.create_task(pump())
+        try:
+            await done
+        finally:
+            pump_task.cancel()
+            terminal.close()
+            self.sessions.discard(terminal)
+            writer.close()
+
+    async def handle_pty(self, master: int, slave: int):
+        loop = asyncio.get_running_loop()
+        output = os.fdopen(os.dup(master), "wb", buffering=0)
+        transport, _ = await loop.connect_write_pipe(asyncio.BaseProtocol, output)
+
+        # Restart the setup utility whenever it exits, the PTY stays open
+        while True:
+            terminal, done = self.start_session(transport, self.size, get_unread(slave))
+
+            def read():
+                try:
+                    terminal.feed(os.read(master, 1024))
+                except BlockingIOError:
+                    pass
+
+            loop.add_reader(master, read)
+            try:
+                await done
+            finally:
+                loop.remove_reader(master)
+                terminal.close()
+                self.sessions.discard(terminal)
+
+
+def get_unread(slave: int) -> Callable[[], int]:
+    # Output of a PTY waits in the kernel until a client opens the slave end
+    # and reads it, with no client attached it would pile up there
+    def unread() -> int:
+        data = fcntl.ioctl(slave, termios.FIONREAD, b"\0\0\0\0")
+        return struct.unpack("i", data)[0]
+
+    return unread
+
+
+def open_pty(size: term.Size) -> tuple[int, int, str]:
+    master, slave = os.openpty()
+    # The slave end stays open so the PTY survives clients coming and going
+    tty.setraw(slave)
+    w, h = size
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", h, w, 0, 0))
+    os.set_blocking(master, False)
+    return master, slave, os.ttyname(slave)
+
+
+async def run(args: argparse.Namespace):
+    pages_gen = getattr(importlib.import_module(args.module), args.pages)
+    server = Server(pages_gen, args.size)
+    servers = []
+
+    if args.unix:
+        servers.append(await asyncio.start_unix_server(server.handle_stream, args.unix))
+        print(f"Listening on {args.unix}")
+
+    if args.port:
+        servers.append(
+            await asyncio.start_server(server.handle_stream, args.host, args.port)
+        )
+        print(f"Listening on {args.host}:{args.port}")
+
+    tasks = []
+    for i in range(args.pty):
+        master, slave, name = open_pty(args.size)
+        tasks.append(asyncio.create_task(server.handle_pty(master, slave)))
+        print(f"Serving on {name}")
+
+    await asyncio.gather(*(s.serve_forever() for s in servers), *tasks)
+
+
+def parse_size(text: str) -> term.Size:
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the setup utility to many clients")
+    parser.add_argument("--module", default="ami_test", help="module with the pages")
+    parser.add_argument("--pages", default="admin_pages", help="page generator list")
+    parser.add_argument("--unix", help="listen on a Unix socket path")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP address")
+    parser.add_argument("--port", type=int, help="listen on a TCP port")
+    parser.add_argument("--pty", type=int, default=0, help="number of PTY pairs")
+    parser.add_argument("--size", type=parse_size, default=default_size, help="WxH")
+    args = parser.parse_args()
+
+    if not (args.unix or args.port or args.pty):
+        parser.error("nothing to serve, use --unix, --port or --pty")
+
+    threading.stack_size(session_stack_size)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import importlib
+import random
+import sys
+import time
+import tracemalloc
+import bios
+import live
+import term
+import ami
+import prerender
+
+
+# Keys sent by the soak test and how often each one is picked,
+# None stands for a read timeout that lets live values refresh
+keys = ["UP", "DOWN", "LEFT", "RIGHT", "ENTER", "ESC", None, "MOUSE", "WHEELDOWN"]
+weights = [20, 20, 8, 8, 10, 2, 2, 6, 2]
+
+
+class SoakFinished(Exception):
+    pass
+
+
+class SoakTerminal(term.Terminal):
+    def __init__(self, size: term.Size, events: int, seed: int, on_sample, interval: int):
+        super().__init__(size)
+        self.random = random.Random(seed)
+        self.events = events
+        self.count = 0
+        self.bytes = 0
+        self.on_sample = on_sample
+        self.interval = interval
+        # Render time of each frame since the last sample
+        self.latencies: list[float] = []
+        self.frame_start: float | None = time.perf_counter()
+
+    def send(self, data: str):
+        self.bytes += len(data)
+
+    def read_key(self, timeout: float | None = None) -> str | None:
+        self.flush()
+        # The frame is drawn once the UI first waits for a key
+        if self.frame_start is not None:
+            self.latencies.append(time.perf_counter() - self.frame_start)
+            self.frame_start = None
+
+        if self.prerender and prerender.is_idle_poll(timeout):
+            time.sleep(timeout)
+            return None
+
+        self.count += 1
+        if self.count % self.interval == 0:
+            self.on_sample(self)
+            self.latencies = []
+        if self.count >= self.events:
+            raise SoakFinished
+
+        key = self.random.choices(keys, weights)[0]
+        if key == "MOUSE":
+            # Click or hover anywhere, most events miss every widget
+            w, h = self.get_size()
+            button = self.random.choice([0, 0, 2, 3])
+            mouse: term.Mouse = {
+                "button": button,
+                "x": self.random.randint(1, w),
+                "y": self.random.randint(1, h),
+                "motion": button == 3,
+                "target": None,
+            }
+            key = self.set_mouse(key, mouse)
+        self.frame_start = time.perf_counter()
+        return key
+
+
+def get_percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Soak:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.baseline: tracemalloc.Snapshot | None = None
+        self.baseline_memory = 0
+        self.baseline_p99 = 0.0
+        self.failure = ""
+        self.snapshot: tracemalloc.Snapshot | None = None
+
+    def take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]
+        )
+
+    def sample(self, terminal: SoakTerminal):
+        memory, peak = tracemalloc.get_traced_memory()
+        p99 = get_percentile(terminal.latencies, 99)
+        samples = terminal.count // self.args.sample
+
+        print(
+            f"{terminal.count:>10} events  {memory / 1024:10.1f} KiB  "
+            f"p99 {p99 * 1000:7.3f} ms",
+            flush=True,
+        )
+
+        # The first samples only warm up caches
+        if samples <= self.args.warmup:
+            return
+        if self.baseline is None:
+            self.baseline = self.take_snapshot()
+            self.baseline_memory = memory
+            self.baseline_p99 = p99
+            return
+
+        growth = memory - self.baseline_memory
+        if growth > self.args.max_growth * 1024:
+            self.failure = f"memory grew by {growth / 1024:.1f} KiB"
+        elif p99 > self.baseline_p99 * self.args.max_drift + 0.001:
+            self.failure = (
+                f"p99 latency drifted from {self.baseline_p99 * 1000:.3f} ms "
+                f"to {p99 * 1000:.3f} ms"
+            )
+        else:
+            return
+
+        self.snapshot = self.take_snapshot()
+        raise SoakFinished
+
+    def run(self) -> bool:
+        pages = getattr(importlib.import_module(self.args.module), self.args.pages)
+        terminal = SoakTerminal(
+            self.args.size,
+            self.args.events,
+            self.args.seed,
+            self.sample,
+            self.args.sample,
+        )
+        terminal.prerender = self.args.prerender
+        term.use(terminal)
+
+        # Waiting on prerendering makes the run slower by an amount that depends
+        # on thread timing, pin live values so the output still only depends
+        # on the seed
+        live.pinned = self.args.prerender
+        tracemalloc.start(self.args.frames)
+        try:
+            # Exiting the setup utility resets the machine, start it again
+            while True:
+                bios.use_state(bios.State())
+                try:
+                    ami.bios_screen(pages)
+                except SystemExit:
+                    pass
+        except SoakFinished:
+            pass
+        finally:
+            tracemalloc.stop()
+            live.pinned = False
+
+        if self.failure:
+            print(f"FAIL: {self.failure}, top allocation sites by growth:")
+            for stat in self.snapshot.compare_to(self.baseline, "lineno")[:10]:
+                print(f"  {stat}")
+            return False
+
+        print(f"PASS: {terminal.count} events, {terminal.bytes} characters written")
+        return True
+
+
+def parse_size(text: str) -> term.Size:
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the setup utility")
+    parser.add_argument("--module", default="ami_test", help="module with the pages")
+    parser.add_argument("--pages", default="admin_pages", help="page generator list")
+    parser.add_argument("--events", type=int, default=1_000_000, help="key events")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--size", type=parse_size, default=(80, 25), help="WxH")
+    parser.add_argument("--sample", type=int, default=10_000, help="events per sample")
+    parser.add_argument("--warmup", type=int, default=1, help="samples to skip")
+    parser.add_argument("--frames", type=int, default=4, help="traceback depth")
+    parser.add_argument(
+        "--max-growth", type=float, default=256, help="allowed memory growth in KiB"
+    )
+    parser.add_argument(
+        "--max-drift", type=float, default=2.0, help="allowed p99 latency ratio"
+    )
+    parser.add_argument(
+        "--prerender", action="store_true", help="prerender tabs like the console"
+    )
+    args = parser.parse_args()
+
+    if not Soak(args).run():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
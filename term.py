@@ -1,10 +1,16 @@
 import os
 import math
-import textwrap
-import termios
-import tty
+import bisect
+import codecs
+import contextvars
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, TypedDict
 import sys
 import color
+import width
 
 
 Rectangle = tuple[int, int, int, int]
@@ -13,9 +19,386 @@ Point = tuple[int, int]
 
 ESC = "\033["
 
+# Buffered writes flushed at once when no key is read in between
+max_buffer = 4096
+
+# Flushes kept for the mirror screen before they are parsed anyway
+max_unmirrored = 64
+
+# Begin and end of a synchronized update, for terminals that support it
+sync_begin = ESC + "?2026h"
+sync_end = ESC + "?2026l"
+
+# Console output is written by a thread, so a stalled terminal doesn't block
+# input. Once max_queued flushes are waiting, they are replaced by a repaint
+# of the mirror screen
+output_thread = True
+max_queued = 8
+
+# Writes blocked for longer than this count as stalls, and how long exiting
+# waits for queued output
+stall_threshold = 0.01
+drain_timeout = 1.0
+
+# SGR mouse reports start with this, motion is only reported if enabled and
+# at most once per mouse_interval seconds
+mouse_prefix = ESC + "<"
+mouse_motion = False
+mouse_interval = 1 / 30
+
+# Keys read_key returns for mouse input
+mouse_keys = ("MOUSE", "WHEELUP", "WHEELDOWN")
+
+
+class Mouse(TypedDict):
+    # 0 left, 1 middle, 2 right, 3 none (motion without a button)
+    button: int
+    x: int
+    y: int
+    motion: bool
+    # Region under the pointer, as registered with set_hits
+    target: Any
+
+
+class HitIndex:
+    def __init__(self):
+        # Clickable regions of each widget, and spans per row built from them
+        self.regions: dict[str, list[tuple[Rectangle, Any]]] = {}
+        self.rows: dict[int, tuple[list[int], list[tuple[int, int, Any]]]] | None = None
+
+    def set(self, name: str, regions: list[tuple[Rectangle, Any]]):
+        self.regions[name] = regions
+        self.rows = None
+
+    def build(self):
+        rows: dict[int, list[tuple[int, int, Any]]] = {}
+        for regions in self.regions.values():
+            for (x, y, w, h), target in regions:
+                for row in range(y, y + h):
+                    rows.setdefault(row, []).append((x, x + w, target))
+
+        self.rows = {}
+        for row, spans in rows.items():
+            spans.sort(key=lambda span: span[0])
+            self.rows[row] = ([span[0] for span in spans], spans)
+
+    def find(self, pt: Point) -> Any:
+        if self.rows is None:
+            self.build()
+
+        x, y = pt
+        if y not in self.rows:
+            return None
+        starts, spans = self.rows[y]
+        i = bisect.bisect_right(starts, x) - 1
+        if i >= 0 and x < spans[i][1]:
+            return spans[i][2]
+        return None
+
+
+class OutputStats(TypedDict):
+    # Flushes waiting to be written
+    queued: int
+    # Seconds the current write has been blocked, and all stalls so far
+    stalled: float
+    stall_time: float
+    # Flushes dropped for repaints
+    replaced: int
+
+
+class Writer:
+    def __init__(self, sink: Callable[[str], None], repaint: Callable[[], Any]):
+        self.sink = sink
+        # Returns output that redraws the whole screen, or None if it can't
+        self.repaint = repaint
+        self.queue: deque[str] = deque()
+        self.cond = threading.Condition()
+        self.writing = False
+        self.write_start = 0.0
+        self.stall_time = 0.0
+        self.replaced = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, data: str):
+        with self.cond:
+            if len(self.queue) >= max_queued:
+                repaint = self.repaint()
+                if repaint is None:
+                    # Nothing to repaint from, wait for the terminal instead
+                    self.cond.wait_for(lambda: len(self.queue) < max_queued)
+                else:
+                    # The repaint includes this flush, older ones aren't needed
+                    self.replaced += len(self.queue) + 1
+                    self.queue.clear()
+                    data = repaint
+            self.queue.append(data)
+            self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue or self.closed)
+                if not self.queue:
+                    return
+                data = "".join(self.queue)
+                self.queue.clear()
+                self.writing = True
+                self.write_start = time.monotonic()
+                self.cond.notify_all()
+
+            try:
+                self.sink(data)
+            except OSError:
+                # The terminal is gone, keep draining so nothing waits on it
+                pass
+
+            with self.cond:
+                elapsed = time.monotonic() - self.write_start
+                if elapsed > stall_threshold:
+                    self.stall_time += elapsed
+                self.writing = False
+                self.cond.notify_all()
+
+    def close(self):
+        # Output not written by now is dropped, the thread ends after the
+        # current write
+        with self.cond:
+            self.closed = True
+            self.queue.clear()
+            self.cond.notify_all()
+
+    def drain(self, timeout: float | None = None) -> bool:
+        with self.cond:
+            return self.cond.wait_for(
+                lambda: not self.queue and not self.writing, timeout
+            )
+
+    def get_stats(self) -> OutputStats:
+        with self.cond:
+            stalled = time.monotonic() - self.write_start if self.writing else 0.0
+            # A write in progress counts the same way as once it's done
+            stall_time = self.stall_time
+            if stalled > stall_threshold:
+                stall_time += stalled
+            return {
+                "queued": len(self.queue),
+                "stalled": stalled,
+                "stall_time": stall_time,
+                "replaced": self.replaced,
+            }
+
+
+class Terminal:
+    def __init__(self, size: Size | None = None):
+        # Pending output, flushed before waiting for input
+        self.buffer: list[str] = []
+        # Fixed size, or None to query the controlling terminal
+        self.size = size
+        # Color pair last set with set_color, None if unknown
+        self.pen: color.Pair | None = None
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        # Decoded input not consumed yet
+        self.pending = ""
+        # Optional in-memory screen of everything sent, output is only parsed
+        # into it by sync_mirror so sending isn't slowed down
+        self.mirror: Any = None
+        self.unmirrored: list[str] = []
+        # Wrap frames in synchronized output brackets (mode 2026), and
+        # whether a bracket was opened by a flush in the middle of a frame
+        self.sync_output = False
+        self.synchronizing = False
+        # Clickable regions, dialogs push their own index on top while open
+        self.hits: list[HitIndex] = [HitIndex()]
+        # Last mouse event read and when motion was last reported
+        self.mouse: Mouse | None = None
+        self.motion_time = 0.0
+        # Output thread, if started, flushes go through it instead of send
+        self.writer: Writer | None = None
+        # Draw tabs next to the current one ahead of time (see ami.prerender_tabs)
+        self.prerender = False
+
+    def get_size(self) -> Size:
+        if self.size is None:
+            col, row = os.get_terminal_size()
+            return col, row
+        return self.size
+
+    def write(self, text: str):
+        self.buffer.append(text)
+        # Don't let output pile up if nothing reads keys for a while
+        if len(self.buffer) >= max_buffer:
+            self.flush(False)
+
+    def flush(self, frame_end: bool = True):
+        if self.buffer or self.synchronizing:
+            data = "".join(self.buffer)
+            self.buffer.clear()
+            if self.sync_output:
+                # The terminal holds the frame until it's complete, so large
+                # repaints don't show half drawn
+                if not self.synchronizing:
+                    data = sync_begin + data
+                if frame_end:
+                    data += sync_end
+                self.synchronizing = not frame_end
+            if self.mirror is not None:
+                self.unmirrored.append(data)
+                if len(self.unmirrored) >= max_unmirrored:
+                    self.sync_mirror()
+            if self.writer is not None:
+                self.writer.put(data)
+            else:
+                self.send(data)
+
+    def start_writer(self):
+        if self.writer is None:
+            self.writer = Writer(self.send, self.get_repaint)
+
+    def get_repaint(self) -> str | None:
+        if self.mirror is None:
+            return None
+        self.sync_mirror()
+        data = self.mirror.repaint()
+        if self.sync_output:
+            # A frame still being drawn closes the bracket itself
+            data = sync_begin + data + ("" if self.synchronizing else sync_end)
+        return data
+
+    def drain(self, timeout: float | None = None):
+        if self.writer is not None:
+            self.writer.drain(drain_timeout if timeout is None else timeout)
+
+    def stop_writer(self):
+        if self.writer is not None:
+            self.drain()
+            self.writer.close()
+            self.writer = None
+
+    def set_mirror(self, mirror: Any):
+        self.mirror = mirror
+        self.unmirrored.clear()
+
+    def sync_mirror(self):
+        if self.unmirrored:
+            data = "".join(self.unmirrored)
+            self.unmirrored.clear()
+            self.mirror.feed(data)
+
+    def send(self, data: str):
+        sys.stdout.write(data)
+        sys.stdout.flush()
+
+    def getch(self, timeout: float | None = None) -> str:
+        if self.pending:
+            ch = self.pending[0]
+            self.pending = self.pending[1:]
+            return ch
+
+        # Only needed once keys are read, keep them out of startup
+        import select
+        import termios
+        import tty
+
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
+        try:
+            tty.setraw(fd, termios.TCSANOW)
+            # Return an empty string if nothing arrives before the timeout
+            if timeout is not None:
+                ready, _, _ = select.select([fd], [], [], max(0, timeout))
+                if not ready:
+                    return ""
+
+            # Read whatever is available, select() can't see buffered input
+            while not self.pending:
+                data = os.read(fd, 1024)
+                if not data:
+                    raise EOFError
+                self.pending = self.decoder.decode(data)
+        finally:
+            # Draining would wait on a stalled terminal, the output thread
+            # keeps writing meanwhile
+            when = termios.TCSADRAIN if self.writer is None else termios.TCSANOW
+            termios.tcsetattr(fd, when, old_settings)
+        return self.getch()
+
+    def read_key(self, timeout: float | None = None) -> str | None:
+        self.flush()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            key = decode_key(self.getch, timeout)
+            if key is None or not key.startswith(ESC):
+                return key
+
+            # Other reports are replies to a probe that gave up waiting
+            if key.startswith(mouse_prefix):
+                key = self.read_mouse(key)
+                if key is not None:
+                    return key
+
+            # Skipped reports don't extend the wait
+            if deadline is not None:
+                timeout = max(0.0, deadline - time.monotonic())
+
+    def read_mouse(self, report: str) -> str | None:
+        key, mouse = decode_mouse(report)
+        if mouse is not None:
+            # Garbled reports may point anywhere, there's nothing to click there
+            cols, rows = self.get_size()
+            if not (1 <= mouse["x"] <= cols and 1 <= mouse["y"] <= rows):
+                return None
+        if mouse is not None and mouse["motion"]:
+            # Drop motion that is already followed by more input, or comes
+            # too soon after the last one
+            now = time.monotonic()
+            if self.pending or now - self.motion_time < mouse_interval:
+                return None
+            self.motion_time = now
+        return self.set_mouse(key, mouse)
+
+    def set_mouse(self, key: str | None, mouse: Mouse | None) -> str | None:
+        if mouse is not None:
+            mouse["target"] = self.hits[-1].find((mouse["x"], mouse["y"]))
+            self.mouse = mouse
+        return key
+
+
+# Terminal of the process, used when no session terminal is active
+console = Terminal()
+console.prerender = True
+
+_current: contextvars.ContextVar[Terminal] = contextvars.ContextVar(
+    "terminal", default=console
+)
+
+
+def current() -> Terminal:
+    return _current.get()
+
+
+def use(terminal: Terminal) -> contextvars.Token:
+    # Bind a terminal to the current thread or asyncio task
+    return _current.set(terminal)
+
+
+def release(token: contextvars.Token):
+    _current.reset(token)
+
 
 def rawprint(*values: object):
-    print(*values, sep="", end="", flush=True)
+    current().write("".join(map(str, values)))
+
+
+def flush():
+    current().flush()
+
+
+def get_output_stats() -> OutputStats | None:
+    writer = current().writer
+    return writer.get_stats() if writer is not None else None
 
 
 def clear():
@@ -24,26 +407,33 @@ def clear():
 
 
 def get_size() -> Size:
-    col, row = os.get_terminal_size()
-    return col, row
+    return current().get_size()
 
 
 def reset():
+    current().pen = None
     rawprint(ESC, "0m")
 
 
 def set_color_raw(c: int):
+    current().pen = None
     rawprint(ESC, c, "m")
 
 
-def set_color(c: color.Color):
+def set_color(c: color.Pair):
+    terminal = current()
+    if terminal.pen == c:
+        return
+
     # Set background
     set_color_raw(color.back + c[0])
     # Set foreground
     set_color_raw(c[1])
+    terminal.pen = c
 
 
 def bgcolor(c: int):
+    current().pen = None
     rawprint(ESC, color.back + c, "m")
 
 
@@ -60,9 +450,12 @@ def fill(rect: Rectangle, c: str = " "):
 
 
 def exit_func():
+    mouse(False)
     reset()
     clear()
     set_pos((1, 1))
+    flush()
+    current().drain()
     exit()
 
 
@@ -105,25 +498,95 @@ class borderProfiles:
 
 
 def get_max_width(text: str) -> int:
-    width = 0
+    max_width = 0
     for l in text.splitlines():
-        width = max(len(l), width)
-    return width
+        max_width = max(width.width(l), max_width)
+    return max_width
 
 
 def get_wrap_height(text: str, w: int) -> int:
     lines = []
     for l in text.splitlines():
-        lines += textwrap.wrap(l, w)
+        lines += width.wrap(l, w)
     return len(lines)
 
 
 def gen_box_line(w: int, splits: list[int], chars: str) -> str:
-    line = chars[0]
+    return _gen_box_line(w, tuple(splits), chars)
+
+
+@functools.lru_cache(maxsize=256)
+def _gen_box_line(w: int, splits: tuple[int, ...], chars: str) -> str:
+    parts = [chars[0]]
+    length = 1
     for split in splits:
-        line += chars[1] * (split - len(line) - 1) + chars[2]
-    line += chars[1] * (w - len(line) - 1) + chars[3]
-    return line
+        parts += [chars[1] * (split - length - 1), chars[2]]
+        length = split
+    parts += [chars[1] * (w - length - 1), chars[3]]
+    return "".join(parts)
+
+
+# Marks a captured blob that doesn't change the current color pair
+_keep_pen: Any = object()
+
+Blob = tuple[str, Any]
+
+
+def capture(render: Callable[[], None]) -> Blob:
+    terminal = current()
+    saved = terminal.buffer
+    pen = terminal.pen
+
+    # Start without a known color so the blob sets every color it uses
+    terminal.buffer = []
+    terminal.pen = _keep_pen
+    try:
+        render()
+        return "".join(terminal.buffer), terminal.pen
+    finally:
+        terminal.buffer = saved
+        terminal.pen = pen
+
+
+def draw_blob(blob: Blob):
+    text, pen = blob
+    terminal = current()
+    terminal.write(text)
+    if pen is not _keep_pen:
+        terminal.pen = pen
+
+
+class BlobCache:
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.blobs: OrderedDict[Any, Blob] = OrderedDict()
+        # Caches are shared by every session of the process
+        self.lock = threading.Lock()
+
+    def get(self, key: Any, render: Callable[[], None]) -> Blob:
+        with self.lock:
+            blob = self.blobs.get(key)
+            if blob is not None:
+                self.blobs.move_to_end(key)
+                return blob
+
+        blob = capture(render)
+
+        with self.lock:
+            self.blobs[key] = blob
+            while len(self.blobs) > self.maxsize:
+                self.blobs.popitem(last=False)
+        return blob
+
+    def draw(self, key: Any, render: Callable[[], None]):
+        draw_blob(self.get(key, render))
+
+    def clear(self):
+        with self.lock:
+            self.blobs.clear()
+
+
+box_cache = BlobCache(64)
 
 
 def draw_box(
@@ -131,6 +594,13 @@ def draw_box(
     hsplit: list[int] = [],
     vsplit: list[int] = [],
 ):
+    box_cache.draw(
+        (rect, tuple(hsplit), tuple(vsplit)),
+        lambda: render_box(rect, hsplit, vsplit),
+    )
+
+
+def render_box(rect: Rectangle, hsplit: list[int], vsplit: list[int]):
     x, y, w, h = rect
 
     line_t = gen_box_line(w, hsplit, borderProfiles.top)
@@ -156,6 +626,32 @@ def cursor(enabled: bool = True):
     rawprint(ESC, "?25", "h" if enabled else "l")
 
 
+def mouse(enabled: bool = True):
+    # Click and wheel reports in SGR format, with motion if mouse_motion is set
+    modes = ["?1000", "?1006"] + (["?1003"] if mouse_motion else [])
+    for mode in modes:
+        rawprint(ESC, mode, "h" if enabled else "l")
+
+
+def get_mouse() -> Mouse | None:
+    return current().mouse
+
+
+def set_hits(name: str, regions: list[tuple[Rectangle, Any]]):
+    current().hits[-1].set(name, regions)
+
+
+def push_hits():
+    # Regions below are out of reach until pop_hits, like under a dialog
+    current().hits.append(HitIndex())
+
+
+def pop_hits():
+    terminal = current()
+    if len(terminal.hits) > 1:
+        terminal.hits.pop()
+
+
 def draw_vsplit(pt: Point, w: int):
     line = gen_box_line(w, [], borderProfiles.middle_vsplit)
     set_pos(pt)
@@ -170,7 +666,11 @@ def draw_text(text: str, rect: Rectangle):
     else:
         lines = []
         for l in text.splitlines():
-            lines += textwrap.wrap(l, w)
+            lines += width.wrap(l, w)
+
+        # Only draw the lines that fit, if the height is given
+        if h:
+            lines = lines[:h]
 
         for i in range(len(lines)):
             set_pos((x, y + i))
@@ -180,7 +680,7 @@ def draw_text(text: str, rect: Rectangle):
 def draw_text_centered(text: str, rect: Rectangle, space: str = " "):
     x, y, w, h = rect
     set_pos((x, y))
-    extra = w - len(text)
+    extra = w - width.width(text)
     rawprint(space * math.floor(extra / 2), text, space * math.ceil(extra / 2))
 
 
@@ -188,7 +688,7 @@ def draw_textblock_centered(text: str, rect: Rectangle, space: str = " "):
     x, y, w, h = rect
     lines = []
     for l in text.splitlines():
-        lines += textwrap.wrap(l, w)
+        lines += width.wrap(l, w)
 
     if len(lines) < h:
         extra = h - len(lines)
@@ -196,7 +696,7 @@ def draw_textblock_centered(text: str, rect: Rectangle, space: str = " "):
 
     for i in range(h):
         set_pos((x, y + i))
-        extra = w - len(lines[i])
+        extra = w - width.width(lines[i])
         rawprint(space * math.floor(extra / 2), lines[i], space * math.ceil(extra / 2))
 
 
@@ -204,57 +704,109 @@ def beep():
     rawprint("\x07")
 
 
-def getch():
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
+def getch(timeout: float | None = None) -> str:
+    return current().getch(timeout)
+
+
+def read_key(timeout: float | None = None) -> str | None:
+    return current().read_key(timeout)
+
+
+# Final part of CSI sequences (after ESC [) for the keys read_key knows
+csi_keys = {
+    "A": "UP",
+    "B": "DOWN",
+    "C": "RIGHT",
+    "D": "LEFT",
+    "H": "HOME",
+    "F": "END",
+    "O": "F1",
+    "P": "F2",
+    "Q": "F3",
+    "R": "F4",
+    "S": "F5",
+    "1~": "HOME",
+    "4~": "END",
+    "5~": "PGUP",
+    "6~": "PGDN",
+    "7~": "HOME",
+    "8~": "END",
+    "15~": "F5",
+    "17~": "F6",
+    "18~": "F7",
+    "19~": "F8",
+    "20~": "F9",
+    "21~": "F10",
+    "23~": "F11",
+    "24~": "F12",
+}
+
+
+def decode_mouse(report: str) -> tuple[str | None, Mouse | None]:
+    # ESC [ < button ; x ; y, then M for a press or m for a release
     try:
-        tty.setraw(fd)
-        ch = sys.stdin.read(1)
-    finally:
-        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-    return ch
+        button, x, y = map(int, report[len(mouse_prefix) : -1].split(";"))
+    except ValueError:
+        return None, None
+
+    if button & 64:
+        if report[-1] != "M":
+            return None, None
+        return ("WHEELDOWN" if button & 1 else "WHEELUP"), None
 
+    motion = bool(button & 32)
+    if report[-1] != "M" and not motion:
+        return None, None
 
-def read_key():
-    c1 = getch()
+    mouse: Mouse = {
+        "button": button & 3,
+        "x": x,
+        "y": y,
+        "motion": motion,
+        "target": None,
+    }
+    return "MOUSE", mouse
+
+
+def encode_mouse(mouse: Mouse) -> str:
+    button = mouse["button"] + (32 if mouse["motion"] else 0)
+    return f"{mouse_prefix}{button};{mouse['x']};{mouse['y']}M"
+
+
+def decode_key(getch, timeout: float | None = None) -> str | None:
+    c1 = getch(timeout)
+
+    if not c1:
+        return None
 
     if c1 == "\x1b":
         c2 = getch()
         if c2 == "[":
-            c3 = getch()
-            if c3 == "A":
-                return "UP"
-            elif c3 == "B":
-                return "DOWN"
-            elif c3 == "C":
-                return "RIGHT"
-            elif c3 == "D":
-                return "LEFT"
-            elif c3 in "OPQRS":  # F1-F4
-                return f'F{ord(c3) - ord("O") + 1}'
-            else:
-                c4 = getch()
-                if c3 == "1":
-                    if c4 == "5":
-                        return "F5"
-                    elif c4 == "7":
-                        return "F6"
-                    elif c4 == "8":
-                        return "F7"
-                    elif c4 == "9":
-                        return "F8"
-                elif c3 == "2":
-                    if c4 == "0":
-                        return "F9"
-                    elif c4 == "1":
-                        return "F10"
-                    elif c4 == "3":
-                        return "F11"
-                    elif c4 == "4":
-                        return "F12"
+            # Read the whole sequence up to its final character
+            seq = getch()
+            while not "@" <= seq[-1] <= "~" or seq == "[":
+                seq += getch()
+            # Mouse and device reports are handled by the terminal that read them
+            if seq[0] in "<?>":
+                return ESC + seq
+            # Terminals without SGR mouse mode send X10 reports instead, with
+            # button and position as characters offset by 32
+            if seq == "M":
+                codes = [ord(getch()) for i in range(3)]
+                # Positions past 95 are sent as bytes that aren't valid UTF-8,
+                # they decode to U+FFFD and can't be told apart, skip them
+                if max(codes) > 0xFF:
+                    return ESC + seq
+                button, x, y = (code - 32 for code in codes)
+                # Releases are button 3, SGR reports mark them with m
+                release = button & 3 == 3 and not button & (32 | 64)
+                return f"{mouse_prefix}{button};{x};{y}{'m' if release else 'M'}"
+            return csi_keys.get(seq, c1)
         else:
             return "ESC"
     elif c1 in ["\n", "\r"]:
         return "ENTER"
+    elif c1 in ["\x7f", "\x08"]:
+        return "BACKSPACE"
 
     return c1
@@ -1,7 +1,12 @@
 import bios
 import color
+import live
 import math
 import term
+import width
+
+
+dialog_cache = term.BlobCache(32)
 
 
 def draw_dialog(
@@ -17,6 +22,20 @@ def draw_dialog(
     x = (tw - w) // 2
     y = (th - h) // 2
 
+    dialog_cache.draw(
+        (size, (tw, th), title, color.get_palette_key(palette), buttonBox),
+        lambda: render_dialog((x, y, w, h), title, palette, buttonBox),
+    )
+
+    # Return position of dialog
+    return x, y
+
+
+def render_dialog(
+    rect: term.Rectangle, title: str, palette: color.Palette, buttonBox: bool
+):
+    x, y, w, h = rect
+
     # Draw shadow
     term.set_color(palette["shadow"])
     term.fill((x + 1, y + h, w, 1))
@@ -29,9 +48,6 @@ def draw_dialog(
     # Draw title text
     term.draw_text_centered(f" {title} ", (x + 1, y, w - 2, 1), term.borders["we"])
 
-    # Return position of dialog
-    return x, y
-
 
 def draw_scrollbar(
     rect: term.Rectangle, current: int, total: int, palette: color.Palette
@@ -43,18 +59,64 @@ def draw_scrollbar(
         return
 
     # Calculate scrollbar height and thumb position
-    sb_height = math.floor(h / total * (h - 2))
+    sb_height = max(1, math.floor(h / total * (h - 2)))
     sb_offset = math.floor(current / total * (h - sb_height - 1))
 
     # Draw scrollbar track
     term.set_color(palette["disabled"])
-    term.fill(x, y + 1, 1, h - 1, term.blocks["ls"])
+    term.fill((x, y + 1, 1, h - 1), term.blocks["ls"])
 
     # Draw arrows and scrollbar thumb
     term.set_color(palette["normal"])
-    term.draw_text(term.arrows["n"], x, y)
-    term.draw_text(term.arrows["s"], x, y + h - 1)
-    term.fill(x, y + sb_offset + 1, 1, sb_height, term.blocks["full"])
+    term.draw_text(term.arrows["n"], (x, y, 0, 0))
+    term.draw_text(term.arrows["s"], (x, y + h - 1, 0, 0))
+    term.fill((x, y + sb_offset + 1, 1, sb_height), term.blocks["full"])
+
+
+def get_item_color(item: bios.Item, selected: bool, palette: color.Palette):
+    if selected:
+        return palette["selected"]
+    elif "type" in item:
+        return palette["normal"]
+    return palette["disabled"]
+
+
+def draw_item_value(
+    item: bios.Item, rect: term.Rectangle, selected: bool, palette: color.Palette
+):
+    x, y, w, h = rect
+
+    if "value" not in item and not live.is_live(item):
+        return
+
+    value = bios.get_value(item)
+
+    if "type" in item:
+        if item["type"] == "select":
+            value = item["values"][value]
+
+    text = f"[{value}]" if "type" in item else value
+
+    term.set_color(get_item_color(item, selected, palette))
+    term.fill((x, y, w, 1))
+    term.draw_text(text, (x, y, w, 1))
+
+
+def draw_item(
+    item: bios.Item, rect: term.Rectangle, selected: bool, palette: color.Palette
+):
+    x, y, w, h = rect
+    pw = (w - 2) // 2
+
+    term.set_color(get_item_color(item, selected, palette))
+
+    if "type" in item:
+        if item["type"] == "subpage":
+            term.draw_text(term.arrows["e"], (x, y, 1, 1))
+
+    term.draw_text(item["title"], (x + 2, y, pw, 1))
+
+    draw_item_value(item, (x + 2 + pw, y, pw, 1), selected, palette)
 
 
 def draw_items(
@@ -65,7 +127,6 @@ def draw_items(
     palette: color.Palette,
 ) -> bios.Range:
     x, y, w, h = rect
-    pw = (w - 2) // 2
 
     term.set_color(palette["normal"])
     term.fill((x, y, w - 1, h))
@@ -76,38 +137,52 @@ def draw_items(
     items_draw = items[start_index:end_index]
     items_count = len(items_draw)
 
-    term.set_color(palette["disabled"])
-
     for i in range(items_count):
         item = items_draw[i]
         if not item:
             continue
 
-        if start_index + i == selected:
-            term.set_color(palette["selected"])
-        elif "type" in item:
-            term.set_color(palette["normal"])
+        draw_item(item, (x, y + i, w, 1), start_index + i == selected, palette)
 
-        if "type" in item:
-            if item["type"] == "subpage":
-                term.draw_text(term.arrows["e"], (x, y + i, 1, 1))
-
-        term.draw_text(item["title"], (x + 2, y + i, pw, 1))
-
-        if "value" in item:
-            value = item["value"]
+    return start_index, end_index
 
-            if "type" in item:
-                if item["type"] == "select":
-                    value = item["values"][value]
 
-            text = f"[{value}]" if "type" in item else value
+def set_item_hits(items: list[bios.Item], current: bios.Range, rect: term.Rectangle):
+    x, y, w, h = rect
+    start_index, end_index = current
+
+    # Rows of the visible items, separators and the scrollbar aren't clickable
+    term.set_hits(
+        "items",
+        [
+            ((x, y + i, w - 1, 1), ("item", start_index + i))
+            for i, item in enumerate(items[start_index:end_index])
+            if item
+        ],
+    )
 
-            term.draw_text(text, (x + 2 + pw, y + i, pw, 1))
 
-        term.set_color(palette["disabled"])
+def draw_item_values(
+    items: list[bios.Item],
+    indexes: list[int],
+    selected: int,
+    current: bios.Range,
+    rect: term.Rectangle,
+    palette: color.Palette,
+):
+    x, y, w, h = rect
+    pw = (w - 2) // 2
+    start_index, end_index = current
 
-    return start_index, end_index
+    # Redraw only the value cells of the given visible items
+    for i in indexes:
+        if start_index <= i < end_index and items[i]:
+            draw_item_value(
+                items[i],
+                (x + 2 + pw, y + i - start_index, pw, 1),
+                i == selected,
+                palette,
+            )
 
 
 def draw_message_box_options(
@@ -121,8 +196,8 @@ def draw_message_box_options(
     max_width = 0
     total_width = 0
     for opt in options:
-        max_width = max(max_width, len(opt))
-        total_width += len(opt)
+        max_width = max(max_width, width.width(opt))
+        total_width += width.width(opt)
 
     count_opt = len(options)
     item_spacing = (w - (max_width * count_opt)) // (count_opt + 1)
@@ -130,12 +205,17 @@ def draw_message_box_options(
     term.set_color(palette["normal"])
 
     term.set_pos((x, y))
+    hits = []
+    column = x
     for i in range(len(options)):
         opt = options[i]
-        len_opt = len(opt)
+        len_opt = width.width(opt)
         offset = (max_width - len_opt) // 2
 
         term.rawprint(" " * (item_spacing + offset))
+        column += item_spacing + offset
+        hits.append(((column, y, len_opt + 2, 1), ("option", i)))
+        column += len_opt + 2
 
         if i == selected:
             term.set_color(palette["selected"])
@@ -145,6 +225,8 @@ def draw_message_box_options(
         if i == selected:
             term.set_color(palette["normal"])
 
+    term.set_hits("options", hits)
+
 
 def message_box(
     title: str,
@@ -166,24 +248,98 @@ def message_box(
         text, (x + 2, y + 1, content_width, content_height + 2)
     )
 
-    while True:
-        draw_message_box_options(
-            (x + 1, y + dialog_height - 2, dialog_width - 2, 1),
-            options,
-            selected,
-            palette,
-        )
+    # Only the dialog can be clicked while it's open
+    term.push_hits()
+    try:
+        while True:
+            draw_message_box_options(
+                (x + 1, y + dialog_height - 2, dialog_width - 2, 1),
+                options,
+                selected,
+                palette,
+            )
+
+            key = term.read_key()
+
+            if key == "LEFT":
+                selected = max(0, selected - 1)
+            elif key == "RIGHT":
+                selected = min(selected + 1, len(options) - 1)
+            elif key == "ENTER":
+                return selected
+            elif key == "MOUSE":
+                mouse = term.get_mouse()
+                if mouse["target"] is not None:
+                    selected = mouse["target"][1]
+                    # Like on pages, only a left click activates
+                    if mouse["button"] == 0 and not mouse["motion"]:
+                        return selected
+            elif key not in term.mouse_keys:
+                term.beep()
+    finally:
+        term.pop_hits()
+
+
+def input_box(
+    title: str,
+    text: str,
+    max_length: int,
+    palette: color.Palette,
+    allowed: str = "",
+) -> str | None:
+    content_width = max(term.get_max_width(text), max_length + 2, width.width(title) + 4)
+    x, y = draw_dialog((content_width + 4, 5), title, palette, False)
+    term.draw_text(text, (x + 2, y + 1, content_width, 1))
+
+    value = ""
+    term.push_hits()
+    try:
+        while True:
+            term.set_color(palette["selected"])
+            term.draw_text(
+                width.pad(f"[{value}]", content_width), (x + 2, y + 3, 0, 0)
+            )
+            term.set_color(palette["normal"])
 
-        key = term.read_key()
+            key = term.read_key()
+
+            if key == "ENTER":
+                return value
+            elif key == "ESC":
+                return None
+            elif key == "BACKSPACE":
+                value = value[:-1]
+            elif key in term.mouse_keys:
+                pass
+            elif (
+                len(key) == 1
+                and key.isprintable()
+                and len(value) < max_length
+                and (not allowed or key in allowed)
+            ):
+                value += key
+            else:
+                term.beep()
+    finally:
+        term.pop_hits()
+
+
+def draw_lines(
+    lines: list[str],
+    start: int,
+    total: int,
+    rect: term.Rectangle,
+    palette: color.Palette,
+):
+    x, y, w, h = rect
+
+    term.set_color(palette["normal"])
+    term.fill((x, y, w - 1, h))
+    draw_scrollbar((x + w - 1, y, 1, h), start, total, palette)
 
-        if key == "LEFT":
-            selected = max(0, selected - 1)
-        elif key == "RIGHT":
-            selected = min(selected + 1, len(options) - 1)
-        elif key == "ENTER":
-            return selected
-        else:
-            term.beep()
+    term.set_color(palette["normal"])
+    for i in range(min(h, len(lines))):
+        term.draw_text(width.truncate(lines[i], w - 2), (x + 1, y + i, 0, 0))
 
 
 def draw_select_box_items(
@@ -225,6 +381,11 @@ def draw_select_box_items(
         if item == items[selected]:
             term.set_color(palette["normal"])
 
+    term.set_hits(
+        "select",
+        [((x, y + i, w, 1), ("select", start_index + i)) for i in range(items_count)],
+    )
+
     return start_index, end_index
 
 
@@ -236,9 +397,9 @@ def select_box(
 ) -> int:
     w, h = term.get_size()
 
-    content_width = len(title) + 4
+    content_width = width.width(title) + 4
     for item in items:
-        content_width = max(content_width, len(item))
+        content_width = max(content_width, width.width(item))
     content_width += 2
 
     total_height = len(items)
@@ -253,22 +414,33 @@ def select_box(
 
     current_range: bios.Range = (0, content_height)
 
-    while True:
-        current_range = draw_select_box_items(
-            (x + 1, y + 1, content_width, content_height),
-            items,
-            selected,
-            current_range,
-            palette,
-        )
-
-        key = term.read_key()
-
-        if key == "UP":
-            selected = max(0, selected - 1)
-        elif key == "DOWN":
-            selected = min(selected + 1, len(items) - 1)
-        elif key == "ENTER":
-            return selected
-        else:
-            term.beep()
+    term.push_hits()
+    try:
+        while True:
+            current_range = draw_select_box_items(
+                (x + 1, y + 1, content_width, content_height),
+                items,
+                selected,
+                current_range,
+                palette,
+            )
+
+            key = term.read_key()
+
+            if key in ("UP", "WHEELUP"):
+                selected = max(0, selected - 1)
+            elif key in ("DOWN", "WHEELDOWN"):
+                selected = min(selected + 1, len(items) - 1)
+            elif key == "ENTER":
+                return selected
+            elif key == "MOUSE":
+                mouse = term.get_mouse()
+                if mouse["target"] is not None:
+                    selected = mouse["target"][1]
+                    # Like on pages, only a left click activates
+                    if mouse["button"] == 0 and not mouse["motion"]:
+                        return selected
+            else:
+                term.beep()
+    finally:
+        term.pop_hits()
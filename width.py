@@ -0,0 +1,153 @@
+import bisect
+import functools
+
+
+@functools.cache
+def get_tables() -> tuple:
+    # Loaded on the first non-ASCII character, ASCII text never needs them
+    import width_table
+
+    return (
+        [start for start, end in width_table.zero_ranges],
+        width_table.zero_ranges,
+        [start for start, end in width_table.wide_ranges],
+        width_table.wide_ranges,
+    )
+
+
+def in_ranges(cp: int, starts: list[int], ranges: tuple) -> bool:
+    i = bisect.bisect_right(starts, cp) - 1
+    return i >= 0 and cp <= ranges[i][1]
+
+
+@functools.lru_cache(maxsize=4096)
+def char_width(ch: str) -> int:
+    cp = ord(ch)
+    if cp < 0x20 or 0x7F <= cp < 0xA0:
+        return 0
+    if cp < 0x300:
+        return 1
+    # Arrows, box drawing, block elements and most shapes are narrow, the
+    # borders, help text and subpage markers of the first frame don't need
+    # the tables
+    if 0x2190 <= cp <= 0x21FF or 0x2500 <= cp <= 0x25FC:
+        return 1
+
+    zero_starts, zero_ranges, wide_starts, wide_ranges = get_tables()
+    if in_ranges(cp, zero_starts, zero_ranges):
+        return 0
+    if in_ranges(cp, wide_starts, wide_ranges):
+        return 2
+    return 1
+
+
+@functools.lru_cache(maxsize=4096)
+def _width(text: str) -> int:
+    return sum(map(char_width, text))
+
+
+def width(text: str) -> int:
+    # ASCII text is one column per character, same cost as len()
+    if text.isascii():
+        return len(text)
+    return _width(text)
+
+
+def truncate(text: str, w: int) -> str:
+    if width(text) <= w:
+        return text
+
+    total = 0
+    for i, ch in enumerate(text):
+        total += char_width(ch)
+        if total > w:
+            return text[:i]
+    return text
+
+
+def pad(text: str, w: int, fill: str = " ") -> str:
+    return text + fill * max(0, w - width(text))
+
+
+def _split_columns(word: str, w: int) -> list[str]:
+    # Break a word that doesn't fit on a line without splitting wide characters
+    parts = []
+    while width(word) > w:
+        part = truncate(word, w) or word[0]
+        parts.append(part)
+        word = word[len(part) :]
+    return parts + [word] if word else parts
+
+
+@functools.lru_cache(maxsize=1024)
+def _wrap(text: str, w: int) -> tuple[str, ...]:
+    if text.isascii():
+        import textwrap
+
+        return tuple(textwrap.wrap(text, w))
+
+    lines = []
+    line = ""
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if width(candidate) <= w:
+            line = candidate
+            continue
+
+        if line:
+            lines.append(line)
+        parts = _split_columns(word, w)
+        lines += parts[:-1]
+        line = parts[-1] if parts else ""
+
+    if line:
+        lines.append(line)
+    return tuple(lines)
+
+
+def wrap(text: str, w: int) -> list[str]:
+    # Short lines are returned as they are, so frequently changing values
+    # such as live clocks don't churn the cache
+    if text and text.strip() == text and text.isprintable() and width(text) <= w:
+        return [text]
+    return list(_wrap(text, w))
+
+
+def generate_tables(path: str = "width_table.py"):
+    import unicodedata
+
+    def is_zero(cp: int) -> bool:
+        if cp == 0x00AD:
+            return False
+        category = unicodedata.category(chr(cp))
+        return category in ("Mn", "Me", "Cf") or 0x1160 <= cp <= 0x11FF
+
+    def is_wide(cp: int) -> bool:
+        eaw = unicodedata.east_asian_width(chr(cp))
+        return eaw in ("W", "F") and not is_zero(cp)
+
+    def get_ranges(pred) -> list[tuple[int, int]]:
+        ranges = []
+        start = None
+        for cp in range(0x110000):
+            if pred(cp):
+                if start is None:
+                    start = cp
+            elif start is not None:
+                ranges.append((start, cp - 1))
+                start = None
+        if start is not None:
+            ranges.append((start, 0x10FFFF))
+        return ranges
+
+    with open(path, "w") as f:
+        f.write(
+            "# Generated by width.generate_tables() from Unicode "
+            f"{unicodedata.unidata_version}, do not edit\n"
+            "# Inclusive code point ranges of zero-width and double-width characters\n"
+        )
+        for name, pred in (("zero_ranges", is_zero), ("wide_ranges", is_wide)):
+            f.write(f"\n{name} = (\n")
+            for start, end in get_ranges(pred):
+                f.write(f"    (0x{start:04X}, 0x{end:04X}),\n")
+            f.write(")\n")